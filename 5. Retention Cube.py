@@ -0,0 +1,29 @@
+#This script precomputes a retention cube over signup cohort, region, provider and free trial so any combination of cuts can be sliced or rolled up without rescanning the customer rows. The cube itself lives in retention.cube, analysts query a saved cube with load_retention_cube and calculate_cube_retention without rebuilding it
+
+import pandas as pd
+from retention.config import run_config
+from retention.analysis import load_retention_data
+from retention.cube import build_retention_cube, save_retention_cube, calculate_cube_retention
+
+# Cleaned dataset, the typed Parquet file written by the clean step, only the columns the cube needs are read
+file_path = 'C:/Users/chris.young/Downloads/cleaned_customer_file.parquet'
+columns = ['signup_date', 'cancellation_date', 'country_region', 'provider', 'free_trial', 'alltime_MRR']
+
+# The cube is saved next to the cleaned data
+cube_path = 'C:/Users/chris.young/Downloads/retention_cube.npz'
+
+if __name__ == '__main__':
+    max_periods = run_config.horizon
+    df = load_retention_data(file_path, columns, run_config)
+    cube, labels = build_retention_cube(df, max_periods)
+    save_retention_cube(cube_path, cube, labels)
+
+    # Example: revenue retention by region x provider, excluding the 'Other' region as the second cut does
+    regions = [region for region in labels['country_region'] if region != 'Other']
+    region_provider_retention = calculate_cube_retention(cube, labels, by=['country_region', 'provider'],
+                                                         filters={'country_region': regions})
+    region_provider_table = pd.DataFrame(
+        region_provider_retention.reshape(-1, max_periods),
+        index=pd.MultiIndex.from_product([regions, labels['provider']], names=['country_region', 'provider']),
+        columns=range(1, max_periods + 1))
+    print(region_provider_table.round(1))
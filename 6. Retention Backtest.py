@@ -0,0 +1,95 @@
+#This script backtests the overall revenue/customer retention curves, computing them as of every month over the last backtest_months months in a single pass over the cleaned data
+
+import pandas as pd
+import numpy as np
+from collections import namedtuple
+import matplotlib.pyplot as plt
+from retention.render import FigureRenderer
+from retention.config import run_config
+from retention.periods import period_names
+from retention.analysis import RetentionCurve, load_retention_data
+
+# Load cleaned dataset, the typed Parquet file written by the clean step is memory-mapped and only the columns used below are read
+file_path = 'C:/Users/chris.young/Downloads/cleaned_customer_file.parquet'
+columns = ['signup_date', 'cancellation_date', 'alltime_MRR']
+
+# Curves are computed as of the run's as-of date and each of the backtest_months - 1 months before it, and saved as
+# tables of retention rate by as-of date and periods since signup
+backtest_months = 24
+revenue_backtest_path = 'C:/Users/chris.young/Downloads/revenue_retention_backtest.csv'
+customer_backtest_path = 'C:/Users/chris.young/Downloads/customer_retention_backtest.csv'
+
+# Batch mode renders every figure headless with the Agg backend into output_dir in the given formats (png, svg, pdf),
+# using render_workers processes, instead of opening a window per figure
+render_mode = 'interactive'
+output_dir = 'C:/Users/chris.young/Downloads/retention_figures_backtest'
+output_formats = ['png']
+render_workers = 4
+
+# Retention curves as of every as-of date at once. As of a date, the customers are those who signed up by then and the
+# lost ones are those who also cancelled by then. Each signup and cancellation is placed at the first as-of date that
+# includes it with a searchsorted over the sorted as-of dates, bincounted per as-of date (and period since signup for
+# cancellations) and summed cumulatively along the as-of dates, so every snapshot comes out of the same pass
+RetentionSweep = namedtuple('RetentionSweep', ['as_of_dates', 'revenue', 'customers'])
+
+def calculate_sweep_curve(signup_index, total_weights, loss_index, loss_weights, n_dates, max_periods):
+    total = np.cumsum(np.bincount(signup_index, weights=total_weights, minlength=n_dates + 1)[:n_dates])
+    lost = np.bincount(loss_index, weights=loss_weights, minlength=(n_dates + 1) * max_periods)
+    lost = np.cumsum(lost.reshape(n_dates + 1, max_periods)[:n_dates], axis=0)
+    remaining = total[:, None] - np.cumsum(lost, axis=1)
+    retention_rate = np.divide(remaining, total[:, None], out=np.zeros(remaining.shape), where=total[:, None] != 0) * 100
+    return RetentionCurve(lost, remaining, retention_rate)
+
+def calculate_retention_sweep(df, as_of_dates, max_periods):
+    as_of = np.asarray(as_of_dates, dtype='datetime64[ns]')
+    n_dates = len(as_of)
+    signup_date = df['signup_date'].to_numpy(dtype='datetime64[ns]')
+    cancellation_date = df['cancellation_date'].to_numpy(dtype='datetime64[ns]')
+    period_diff = df['period_diff'].to_numpy(dtype='float64', na_value=np.nan)
+    alltime_MRR = df['alltime_MRR'].to_numpy(dtype='float64', na_value=np.nan)
+
+    # Customers without a signup date never make it into a snapshot, revenue measures skip customers without an MRR
+    signup_index = np.where(np.isnat(signup_date), n_dates, np.searchsorted(as_of, signup_date))
+    lost = ~np.isnat(cancellation_date) & (period_diff >= 1) & (period_diff <= max_periods)
+    loss_index = np.searchsorted(as_of, cancellation_date[lost]) * max_periods + period_diff[lost].astype(int) - 1
+    lost_MRR = alltime_MRR[lost]
+    has_revenue = ~np.isnan(lost_MRR)
+
+    revenue = calculate_sweep_curve(signup_index, np.nan_to_num(alltime_MRR), loss_index[has_revenue],
+                                    lost_MRR[has_revenue], n_dates, max_periods)
+    customers = calculate_sweep_curve(signup_index, None, loss_index, None, n_dates, max_periods)
+    return RetentionSweep(pd.DatetimeIndex(as_of, name='as_of_date'), revenue, customers)
+
+if __name__ == '__main__':
+    df = load_retention_data(file_path, columns, run_config)
+
+    # As-of dates a month apart ending at the run's as-of date, each counted back from it so month ends stay month ends
+    max_periods = run_config.horizon
+    as_of_dates = [run_config.as_of_date - pd.DateOffset(months=months) for months in range(backtest_months - 1, -1, -1)]
+    sweep = calculate_retention_sweep(df, as_of_dates, max_periods)
+
+    revenue_backtest = pd.DataFrame(np.round(sweep.revenue.retention_rate, 2), index=sweep.as_of_dates,
+                                    columns=range(1, max_periods + 1))
+    customer_backtest = pd.DataFrame(np.round(sweep.customers.retention_rate, 2), index=sweep.as_of_dates,
+                                     columns=range(1, max_periods + 1))
+    revenue_backtest.to_csv(revenue_backtest_path)
+    customer_backtest.to_csv(customer_backtest_path)
+
+    # Plotting retention after a few milestone periods since signup across the as-of dates
+    renderer = FigureRenderer(render_mode, output_dir, output_formats, render_workers)
+    period_name = period_names[run_config.granularity]
+    shown_periods = sorted({period for period in (1, 3, 6, 12, max_periods) if period <= max_periods})
+    for backtest, name in [(revenue_backtest, 'Revenue'), (customer_backtest, 'Customer')]:
+        fig, ax = plt.subplots(figsize=(12, 6))
+        for period in shown_periods:
+            ax.plot(backtest.index, backtest[period], marker='o', linestyle='-', label=f'{period_name} {period}')
+
+        ax.set_title(f'{name} Retention Backtest')
+        ax.set_xlabel('As-of Date')
+        ax.set_ylabel(f'{name} Retention Rate (%)')
+        ax.set_ylim(0, 100)
+        ax.grid(True)
+        ax.legend(loc='best')
+        renderer.show()
+
+    renderer.close()
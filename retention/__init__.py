@@ -0,0 +1,14 @@
+#This package is the importable side of the retention analysis, the clean step, the overall and cohort retention calculations and the segment cuts, used by the numbered scripts, the retention command line and jobs calling them in-process. Nothing imported here loads matplotlib or pycountry, figures are drawn by retention.report
+
+from retention.config import RunConfig, run_config, load_run_config
+from retention.periods import add_signup_periods, period_names
+from retention.schema import customer_schema, apply_schema
+from retention.clean import run_clean, clean_customer_file, stream_clean_customer_file
+from retention.compact import load_compact_retention_data
+from retention.analysis import (RetentionCurve, RetentionResults, CohortTables, calculate_retention_curve,
+                                calculate_retention_results, load_retention_data, scan_retention_results,
+                                compute_retention_results, curve_table, cohort_tables)
+from retention.segments import (SegmentRetention, calculate_segmented_retention, calculate_segmented_retention_parallel,
+                                scan_segmented_retention, compute_segmented_retention, segment_table, segment_cut_names)
+from retention.cube import (build_retention_cube, save_retention_cube, load_retention_cube, roll_up,
+                            calculate_cube_retention)
@@ -0,0 +1,6 @@
+#Running the package with python -m retention is the same as the retention command
+
+import sys
+from retention.cli import main
+
+sys.exit(main())
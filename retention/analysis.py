@@ -0,0 +1,289 @@
+#This module holds the overall and cohort retention calculations, the revenue and customer retention curves, the cohort x period aggregates kept in an incremental state store and the tables built from them, along with loading the cleaned data and caching the results
+
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from collections import namedtuple
+import retention.periods
+from retention.periods import add_signup_periods
+from retention.cache import result_cache_key, load_cached_result, save_cached_result
+from retention.profile import disabled_profiler
+import retention.compact
+from retention.compact import load_compact_retention_data
+
+# Retention curve for periods 1 to max_periods in a single pass. Losses are bincounted by period_diff (weighted by MRR
+# for revenue) and subtracted cumulatively from the starting total
+RetentionCurve = namedtuple('RetentionCurve', ['lost', 'remaining', 'retention_rate'])
+
+def calculate_period_losses(period_diff, max_periods, weights=None):
+    period_diff = period_diff.to_numpy(dtype='float64', na_value=np.nan)
+    in_range = (period_diff >= 1) & (period_diff <= max_periods)
+    if weights is not None:
+        weights = weights.to_numpy(dtype='float64', na_value=np.nan)
+        in_range &= ~np.isnan(weights)
+        weights = weights[in_range]
+    return np.bincount(period_diff[in_range].astype(int) - 1, weights=weights, minlength=max_periods)
+
+def retention_curve(lost, total):
+    remaining = total - np.cumsum(lost)
+    return RetentionCurve(lost, remaining, (remaining / total) * 100)
+
+def calculate_retention_curve(period_diff, total, max_periods, weights=None):
+    return retention_curve(calculate_period_losses(period_diff, max_periods, weights), total)
+
+# Cohort x period aggregates. Each customer's MRR counts towards every period they were active, written into a difference
+# array as +MRR at period 1 and -MRR after their last period and then summed along the periods. Active customers are
+# tracked the same way so periods nobody reached are exactly zero rather than rounding residue. Lost revenue, cohort
+# sizes and lost users per period_diff are scatter-added. Every aggregate is a sum over customers, so the state can be
+# built from all customers or updated by adding new rows and subtracting old ones
+CohortRevenue = namedtuple('CohortRevenue', ['cohorts', 'total_revenue', 'lost_revenue'])
+cohort_aggregates = ['revenue_changes', 'customer_changes', 'lost_revenue', 'cohort_sizes', 'lost_users']
+cohort_snapshot_columns = ['oid', 'cohort', 'period_diff', 'alltime_perioddiff', 'alltime_MRR']
+
+def calculate_cohort_contributions(df, cohorts, max_periods, n_period_diffs):
+    cohort_codes = cohorts.get_indexer(df['cohort'])
+    alltime_MRR = df['alltime_MRR'].to_numpy(dtype='float64', na_value=np.nan)
+    alltime_perioddiff = df['alltime_perioddiff'].to_numpy(dtype='float64', na_value=np.nan)
+    period_diff = df['period_diff'].to_numpy(dtype='float64', na_value=np.nan)
+    in_cohort = cohort_codes >= 0
+    has_revenue = in_cohort & ~np.isnan(alltime_MRR)
+
+    active = has_revenue & (alltime_perioddiff >= 1)
+    active_cohorts = cohort_codes[active]
+    active_MRR = alltime_MRR[active]
+    last_period = np.minimum(alltime_perioddiff[active], max_periods).astype(int)
+    revenue_changes = np.zeros((len(cohorts), max_periods + 1))
+    customer_changes = np.zeros((len(cohorts), max_periods + 1), dtype=int)
+    np.add.at(revenue_changes, (active_cohorts, 0), active_MRR)
+    np.add.at(revenue_changes, (active_cohorts, last_period), -active_MRR)
+    np.add.at(customer_changes, (active_cohorts, 0), 1)
+    np.add.at(customer_changes, (active_cohorts, last_period), -1)
+
+    lost = has_revenue & (period_diff >= 1) & (period_diff <= max_periods)
+    lost_revenue = np.zeros((len(cohorts), max_periods))
+    np.add.at(lost_revenue, (cohort_codes[lost], period_diff[lost].astype(int) - 1), alltime_MRR[lost])
+
+    cancelled = in_cohort & (period_diff >= 0)
+    lost_users = np.zeros((len(cohorts), n_period_diffs), dtype=int)
+    np.add.at(lost_users, (cohort_codes[cancelled], period_diff[cancelled].astype(int)), 1)
+    cohort_sizes = np.bincount(cohort_codes[in_cohort], minlength=len(cohorts))
+    return {'revenue_changes': revenue_changes, 'customer_changes': customer_changes, 'lost_revenue': lost_revenue,
+            'cohort_sizes': cohort_sizes, 'lost_users': lost_users}
+
+def empty_cohort_state(max_periods, granularity):
+    return {'cohorts': pd.PeriodIndex([], freq=granularity), 'revenue_changes': np.zeros((0, max_periods + 1)),
+            'customer_changes': np.zeros((0, max_periods + 1), dtype=int), 'lost_revenue': np.zeros((0, max_periods)),
+            'cohort_sizes': np.zeros(0, dtype=int), 'lost_users': np.zeros((0, 1), dtype=int)}
+
+# Move the aggregates onto a new set of cohort rows and a wider period_diff axis, new cohorts start at zero
+def reindex_cohort_state(state, cohorts, n_period_diffs):
+    old_rows = state['cohorts'].get_indexer(cohorts)
+    found = old_rows >= 0
+    reindexed = {'cohorts': cohorts}
+    for aggregate in cohort_aggregates:
+        values = state[aggregate]
+        shape = (len(cohorts),) + ((n_period_diffs,) if aggregate == 'lost_users' else values.shape[1:])
+        reindexed[aggregate] = np.zeros(shape, dtype=values.dtype)
+        if aggregate == 'lost_users':
+            reindexed[aggregate][found, :values.shape[1]] = values[old_rows[found]]
+        else:
+            reindexed[aggregate][found] = values[old_rows[found]]
+    return reindexed
+
+def apply_cohort_delta(state, added, removed, max_periods):
+    cohorts = state['cohorts'].union(pd.PeriodIndex(added['cohort'].dropna().unique(), freq=state['cohorts'].freq)).sort_values()
+    n_period_diffs = state['lost_users'].shape[1]
+    if added['period_diff'].notna().any():
+        n_period_diffs = max(n_period_diffs, int(added['period_diff'].max()) + 1)
+    state = reindex_cohort_state(state, cohorts, n_period_diffs)
+    for rows, sign in [(added, 1), (removed, -1)]:
+        contributions = calculate_cohort_contributions(rows, cohorts, max_periods, n_period_diffs)
+        for aggregate in cohort_aggregates:
+            state[aggregate] += sign * contributions[aggregate]
+
+    # Cohorts whose customers were all removed are dropped
+    return reindex_cohort_state(state, cohorts[state['cohort_sizes'] > 0], n_period_diffs)
+
+def save_cohort_state(path, state, max_periods, granularity):
+    np.savez_compressed(path, cohorts=state['cohorts'].astype(str).to_numpy(dtype=str), max_periods=max_periods,
+                        granularity=granularity, **{aggregate: state[aggregate] for aggregate in cohort_aggregates})
+
+# A missing state or one built for a different horizon or granularity means a full rebuild
+def load_cohort_state(path, snapshot_path, max_periods, granularity):
+    if not (os.path.exists(path) and os.path.exists(snapshot_path)):
+        return None
+    with np.load(path) as saved:
+        if saved.get('max_periods') != max_periods or str(saved.get('granularity')) != granularity:
+            return None
+        state = {aggregate: saved[aggregate] for aggregate in cohort_aggregates}
+        state['cohorts'] = pd.PeriodIndex(saved['cohorts'], freq=granularity)
+    return state
+
+# A customer row that is identical in the snapshot and the current data cancels out, what is left are the old
+# versions of removed or changed customers and the new versions of added or changed customers
+def find_cohort_delta(df, snapshot):
+    current = df[cohort_snapshot_columns]
+    combined = pd.concat([snapshot.assign(is_current=False), current.assign(is_current=True)], ignore_index=True)
+    delta = combined.drop_duplicates(subset=cohort_snapshot_columns, keep=False)
+    return delta[delta['is_current']], delta[~delta['is_current']], current
+
+# With a state_path the cohort aggregates are kept in a state store at state_path and snapshot_path and only the customers
+# that were added, removed or changed since the last run are applied, without one every cohort is computed from scratch
+def calculate_cohort_state(df, max_periods, granularity, state_path=None, snapshot_path=None):
+    state = load_cohort_state(state_path, snapshot_path, max_periods, granularity) if state_path else None
+    if state is None:
+        state = apply_cohort_delta(empty_cohort_state(max_periods, granularity), df, df.iloc[:0], max_periods)
+        current = df[cohort_snapshot_columns] if state_path else None
+    else:
+        added, removed, current = find_cohort_delta(df, pd.read_parquet(snapshot_path))
+        state = apply_cohort_delta(state, added, removed, max_periods)
+    if state_path:
+        save_cohort_state(state_path, state, max_periods, granularity)
+        current.to_parquet(snapshot_path, index=False)
+    return state
+
+def calculate_cohort_revenue(state, max_periods):
+    total_revenue = np.cumsum(state['revenue_changes'], axis=1)[:, :max_periods]
+    total_revenue[np.cumsum(state['customer_changes'], axis=1)[:, :max_periods] == 0] = 0
+    return CohortRevenue(state['cohorts'], total_revenue, state['lost_revenue'])
+
+# Cohort x period customer survival from the cohort state. Survivors at the start of each period are the cohort size less
+# everyone lost in earlier periods (period 0 cancellations are not subtracted) and the conditional retention rate is the
+# share of them not lost that period, periods without any lost customers show 0
+CohortSurvival = namedtuple('CohortSurvival', ['cohorts', 'lost_users', 'survivors', 'retention_rate'])
+
+def calculate_cohort_survival(state, max_periods):
+    lost_users = state['lost_users'][:, 1:]
+    lost_users = np.pad(lost_users, ((0, 0), (0, max(max_periods - lost_users.shape[1], 0))))
+    survivors = state['cohort_sizes'][:, None] - np.cumsum(lost_users, axis=1)
+    survivors = np.hstack([state['cohort_sizes'][:, None], survivors])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retention_rate = np.where(lost_users > 0, (1 - lost_users / survivors[:, :-1]) * 100, 0)
+    return CohortSurvival(state['cohorts'], lost_users, survivors, retention_rate)
+
+# Every curve and matrix the figures are drawn from, computed in one go so a rerun can take them from the result cache
+RetentionResults = namedtuple('RetentionResults', ['revenue_curve', 'customer_curve', 'cohort_state', 'cohort_revenue',
+                                                   'cohort_survival'])
+
+def calculate_retention_results(df, max_periods, granularity, state_path=None, snapshot_path=None,
+                                profiler=disabled_profiler):
+    # The total revenue is the denominator in revenue retention
+    with profiler.stage('curves', len(df)):
+        total_initial_revenue = df['alltime_MRR'].astype('float64', copy=False).sum()
+        revenue_curve = calculate_retention_curve(df['period_diff'], total_initial_revenue, max_periods, weights=df['alltime_MRR'])
+        customer_curve = calculate_retention_curve(df['period_diff'], df.shape[0], max_periods)
+    with profiler.stage('cohorts', len(df)):
+        cohort_state = calculate_cohort_state(df, max_periods, granularity, state_path, snapshot_path)
+        cohort_revenue = calculate_cohort_revenue(cohort_state, max_periods)
+        cohort_survival = calculate_cohort_survival(cohort_state, max_periods)
+    return RetentionResults(revenue_curve, customer_curve, cohort_state, cohort_revenue, cohort_survival)
+
+# Cleaned data with the cohort and periods since signup of every customer at the run's granularity. The typed Parquet
+# file written by the clean step is memory-mapped and only the given columns are read. It may also be a hive-partitioned
+# directory, filters (pyarrow filter tuples) then skip whole partitions rather than filtering rows after the read
+def load_retention_data(file_path, columns, config, profiler=disabled_profiler, filters=None):
+    with profiler.stage('load') as stage:
+        df = pq.read_table(file_path, columns=columns, filters=filters, memory_map=True).to_pandas()
+        stage.rows_in = stage.rows_out = len(df)
+    with profiler.stage('periods', len(df)):
+        df = add_signup_periods(df, config.granularity, config.as_of_date)
+    return df
+
+# The same data a batch of batch_size rows at a time, for computations that never hold the whole file in memory
+def scan_retention_data(file_path, columns, config, filters=None, batch_size=1_000_000):
+    dataset = ds.dataset(file_path, format='parquet', partitioning='hive')
+    for batch in dataset.to_batches(columns=columns, batch_size=batch_size,
+                                    filter=pq.filters_to_expression(filters) if filters else None):
+        if batch.num_rows:
+            yield add_signup_periods(batch.to_pandas(), config.granularity, config.as_of_date)
+
+# Out-of-core counterpart of calculate_retention_results for cleaned files larger than memory. The curves and cohort
+# aggregates are all sums over customers, so every batch's losses and cohort contributions are added to running totals
+# and only the cohort x period arrays outlive the batch. Counts are identical to the in-memory results, revenue sums
+# can differ in the last bits as they are added up batch by batch
+def scan_retention_results(file_path, config, profiler=disabled_profiler, batch_size=1_000_000):
+    max_periods = config.horizon
+    state = empty_cohort_state(max_periods, config.granularity)
+    total_initial_revenue, n_customers = 0.0, 0
+    lost_revenue, lost_customers = np.zeros(max_periods), np.zeros(max_periods, dtype=int)
+    with profiler.stage('scan') as stage:
+        for df in scan_retention_data(file_path, retention_columns[1:], config, batch_size=batch_size):
+            total_initial_revenue += df['alltime_MRR'].sum()
+            n_customers += len(df)
+            lost_revenue += calculate_period_losses(df['period_diff'], max_periods, weights=df['alltime_MRR'])
+            lost_customers += calculate_period_losses(df['period_diff'], max_periods)
+            state = apply_cohort_delta(state, df, df.iloc[:0], max_periods)
+        stage.rows_out = n_customers
+    with profiler.stage('cohorts', n_customers):
+        cohort_revenue = calculate_cohort_revenue(state, max_periods)
+        cohort_survival = calculate_cohort_survival(state, max_periods)
+    return RetentionResults(retention_curve(lost_revenue, total_initial_revenue),
+                            retention_curve(lost_customers, n_customers), state, cohort_revenue, cohort_survival)
+
+# Results are cached in cache_dir under a hash of the cleaned file's contents, the run config and the code computing them,
+# so a rerun on unchanged data skips loading it. The least recently used results are evicted once the cache outgrows
+# cache_max_bytes, no cache_dir computes the results every time. compact loads the data with
+# load_compact_retention_data, a fraction of the memory for MRR summed in float32, and only reads the OIDs when there is
+# a state store to update. out_of_core computes the results with scan_retention_results instead, which cannot keep a
+# state store since that needs every customer's row at once
+retention_columns = ['oid', 'signup_date', 'cancellation_date', 'alltime_MRR']
+
+def compute_retention_results(file_path, config, cache_dir=None, cache_max_bytes=500_000_000, state_path=None,
+                              snapshot_path=None, profiler=disabled_profiler, compact=False, out_of_core=False):
+    if out_of_core and state_path:
+        raise ValueError('The cohort state store cannot be updated out of core, run without a state_path')
+    if cache_dir:
+        with profiler.stage('cache_lookup'):
+            code_paths = [__file__, retention.periods.__file__]
+            params = config._asdict()
+            if out_of_core:
+                params['out_of_core'] = True
+            elif compact:
+                code_paths.append(retention.compact.__file__)
+                params['compact'] = True
+            cache_key = result_cache_key(file_path, params, code_paths, cache_dir)
+            results = load_cached_result(cache_dir, cache_key)
+        if results is not None:
+            return results
+    if out_of_core:
+        results = scan_retention_results(file_path, config, profiler)
+    else:
+        if compact:
+            columns = retention_columns if state_path else retention_columns[1:]
+            df = load_compact_retention_data(file_path, columns, config, profiler)
+        else:
+            df = load_retention_data(file_path, retention_columns, config, profiler)
+        results = calculate_retention_results(df, config.horizon, config.granularity, state_path, snapshot_path,
+                                              profiler)
+    if cache_dir:
+        with profiler.stage('cache_save'):
+            save_cached_result(cache_dir, cache_key, results, cache_max_bytes)
+    return results
+
+# Lost, remaining and retention rate per period since signup of a revenue or customer curve
+def curve_table(curve, period_name):
+    return pd.DataFrame({period_name: range(1, len(curve.lost) + 1), 'Lost': curve.lost, 'Remaining': curve.remaining,
+                         'Retention Rate (%)': curve.retention_rate})
+
+# Cohort x period tables behind the heatmaps: revenue retention and lost revenue for every cohort and period, customer
+# retention and lost users only for the cohorts and periods with lost customers
+CohortTables = namedtuple('CohortTables', ['revenue_retention', 'lost_revenue', 'customer_retention', 'lost_users'])
+
+def cohort_tables(results, max_periods):
+    cohort_revenue, cohort_survival = results.cohort_revenue, results.cohort_survival
+    remaining_revenue = cohort_revenue.total_revenue - cohort_revenue.lost_revenue
+    revenue_retention = np.divide(remaining_revenue, cohort_revenue.total_revenue,
+                                  out=np.zeros_like(remaining_revenue), where=cohort_revenue.total_revenue != 0) * 100
+    periods = range(1, max_periods + 1)
+
+    shown_cohorts = results.cohort_state['lost_users'].any(axis=1)
+    shown_periods = cohort_survival.lost_users.any(axis=0)
+    shown_index = pd.Index(cohort_survival.cohorts[shown_cohorts], name='cohort')
+    shown_columns = pd.Index(np.flatnonzero(shown_periods) + 1, name='period_diff')
+    return CohortTables(
+        pd.DataFrame(revenue_retention, index=cohort_revenue.cohorts, columns=periods),
+        pd.DataFrame(cohort_revenue.lost_revenue, index=cohort_revenue.cohorts, columns=periods),
+        pd.DataFrame(cohort_survival.retention_rate[shown_cohorts][:, shown_periods], index=shown_index, columns=shown_columns),
+        pd.DataFrame(cohort_survival.lost_users[shown_cohorts][:, shown_periods], index=shown_index, columns=shown_columns))
@@ -0,0 +1,75 @@
+#This module holds the on-disk result cache used by the analysis scripts. Results are stored under a hash of the input file's contents, the parameters and the code that computed them, so a rerun on unchanged data can skip loading it
+
+import os
+import json
+import glob
+import pickle
+import hashlib
+import tempfile
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Content hash of the input file, or of every file under a partitioned input directory together with its relative path.
+# Hashes are remembered in the cache directory by path, size and modification time, so an unchanged file is only read
+# once rather than on every run
+def file_fingerprint(path, cache_dir):
+    if os.path.isdir(path):
+        files = sorted(os.path.relpath(file, path) for file in glob.glob(os.path.join(glob.escape(path), '**', '*'),
+                                                                         recursive=True) if os.path.isfile(file))
+        fingerprints = [[file, file_fingerprint(os.path.join(path, file), cache_dir)] for file in files]
+        return hashlib.sha256(json.dumps(fingerprints).encode()).hexdigest()
+    index_path = os.path.join(cache_dir, 'fingerprints.json')
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path) as file:
+            index = json.load(file)
+    stat = os.stat(path)
+    entry = index.get(os.path.abspath(path))
+    if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+        return entry['sha256']
+
+    index[os.path.abspath(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_digest(path)}
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=cache_dir, suffix='.tmp', delete=False) as file:
+        json.dump(index, file)
+    os.replace(file.name, index_path)
+    return index[os.path.abspath(path)]['sha256']
+
+def result_cache_key(input_path, params, code_paths, cache_dir):
+    key = {'input': file_fingerprint(input_path, cache_dir), 'params': params,
+           'code': [file_digest(code_path) for code_path in code_paths]}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+# Reading a result marks it as recently used through its modification time
+def load_cached_result(cache_dir, key):
+    path = os.path.join(cache_dir, f'{key}.pkl')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as file:
+        result = pickle.load(file)
+    os.utime(path)
+    return result
+
+# Results are written to a temporary file and renamed into place, then the least recently used results are removed until
+# the cache fits in max_bytes again. The result just written is always kept
+def save_cached_result(cache_dir, key, result, max_bytes):
+    result_bytes = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    os.makedirs(cache_dir, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=cache_dir, suffix='.tmp', delete=False) as file:
+        file.write(result_bytes)
+    path = os.path.join(cache_dir, f'{key}.pkl')
+    os.replace(file.name, path)
+
+    entries = sorted(glob.glob(os.path.join(cache_dir, '*.pkl')), key=os.path.getmtime)
+    total_bytes = sum(os.path.getsize(entry) for entry in entries)
+    for entry in entries:
+        if total_bytes <= max_bytes:
+            break
+        if entry != path:
+            total_bytes -= os.path.getsize(entry)
+            os.remove(entry)
@@ -0,0 +1,577 @@
+#This module holds the clean step, removing OID duplicates, standardizing dates for signup, conversion and cancellation, back filling missing MRR and adding geography and free trial features, and writing the cleaned CSV and Parquet files. pycountry is only imported when a country name is not in the country cache
+
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import hashlib
+import json
+import os
+import glob
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pandas.api.types import union_categoricals
+from retention.profile import disabled_profiler
+from retention.schema import customer_schema, schema_read_options, apply_schema
+
+# Data cleaning
+# Text values are stripped with the vectorized string methods, categories by stripping each distinct value once and
+# merging the ones that only differed by whitespace. Cells of a text column that are not strings are kept as they are
+def strip_text(values):
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes, categories = pd.factorize(values.cat.categories.str.strip())
+        old_codes = values.cat.codes.to_numpy()
+        stripped = pd.Categorical.from_codes(np.where(old_codes >= 0, codes[old_codes], -1), categories)
+        return pd.Series(stripped, index=values.index, name=values.name)
+    inferred_type = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred_type not in ('string', 'mixed', 'mixed-integer'):
+        return values
+    stripped = values.str.strip()
+    if inferred_type == 'string':
+        return stripped
+    return stripped.where(stripped.notna() | values.isna(), values)
+
+# Remove leading/trailing spaces from column names and text columns, numeric columns are left alone
+def strip_whitespace(df):
+    df.columns = df.columns.str.strip()
+    for column in df.select_dtypes(include=['object', 'string', 'category']).columns:
+        df[column] = strip_text(df[column])
+    return df
+
+# Rows with a value that does not match the customer schema (a date in another format, text in a number column) are
+# written as read to the reject file with the columns that failed, no reject file only counts them
+def report_rejected_rows(n_rejected_rows, rejected_file_path):
+    if n_rejected_rows:
+        print(f"Rejected {n_rejected_rows} rows that do not match the customer schema"
+              + (f", written to {rejected_file_path}" if rejected_file_path else ""))
+
+def write_rejected_rows(rejected_rows, rejected_file_path, header=True):
+    if rejected_file_path:
+        rejected_rows.to_csv(rejected_file_path, mode='w' if header else 'a', header=header, index=False)
+
+# Input files
+# file_path is one CSV or Parquet export, a directory of them (subdirectories included) or a glob pattern. Files are taken
+# in path order, so exports named by date run from oldest to newest
+def customer_files(file_path):
+    if os.path.isfile(file_path):
+        return [file_path]
+    if os.path.isdir(file_path):
+        paths = glob.glob(os.path.join(glob.escape(file_path), '**', '*'), recursive=True)
+    else:
+        paths = glob.glob(file_path, recursive=True)
+    files = sorted(path for path in paths if path.lower().endswith(('.csv', '.parquet')))
+    if not files:
+        raise FileNotFoundError(f"No CSV or Parquet customer files found at {file_path}")
+    return files
+
+# Parquet exports are read like the CSV ones, category columns as categories and string columns (an OID stored as a
+# number too) as text, so both go through the same strip and parse
+def parquet_export_frame(table):
+    for column, dtype in customer_schema.items():
+        if dtype == 'string':
+            table = table.set_column(table.schema.get_field_index(column), column, table[column].cast(pa.string()))
+    return table.to_pandas().astype({column: 'category' for column, dtype in customer_schema.items() if dtype == 'category'})
+
+def read_customer_file(file_path):
+    if file_path.lower().endswith('.parquet'):
+        return parquet_export_frame(pq.read_table(file_path, columns=list(customer_schema)))
+    return pd.read_csv(file_path, encoding='utf-8', **schema_read_options(file_path))
+
+def read_customer_chunks(file_path, chunk_size):
+    if file_path.lower().endswith('.parquet'):
+        for batch in pq.ParquetFile(file_path).iter_batches(chunk_size, columns=list(customer_schema)):
+            yield parquet_export_frame(batch)
+    else:
+        yield from pd.read_csv(file_path, encoding='utf-8', chunksize=chunk_size, **schema_read_options(file_path))
+
+# Every file is read, stripped and parsed in a worker thread of its own, the CSV and Parquet readers release the GIL for
+# most of their work. Each of the three runs over every file before the next starts, so they are timed as stages of
+# their own. Files are then stacked in file order with the categories of each text column merged, file_numbers gives
+# the file every row came from. Rejected rows name their file in source_file
+def read_customer_files(files, read_workers, profiler=disabled_profiler):
+    with ThreadPoolExecutor(max(1, min(read_workers, len(files)))) as pool:
+        with profiler.stage('read') as stage:
+            frames = list(pool.map(read_customer_file, files))
+            n_rows = sum(len(df) for df in frames)
+            stage.rows_in = n_rows
+        with profiler.stage('strip', n_rows):
+            frames = list(pool.map(strip_whitespace, frames))
+        with profiler.stage('parse', n_rows) as stage:
+            frames = list(pool.map(apply_schema, frames))
+            stage.rows_out = sum(len(df) for df, _ in frames)
+    rejected_rows = [rejected.assign(source_file=path) for path, (_, rejected) in zip(files, frames)]
+    rejected_rows = pd.concat([rejected for rejected in rejected_rows if len(rejected)] or rejected_rows[:1])
+    frames = [df for df, _ in frames]
+    file_numbers = pd.Series(np.repeat(np.arange(len(frames)), [len(df) for df in frames]))
+    if len(frames) == 1:
+        return frames[0], file_numbers.set_axis(frames[0].index), rejected_rows
+    for column, dtype in customer_schema.items():
+        if dtype == 'category':
+            categories = union_categoricals([df[column] for df in frames]).categories
+            for df in frames:
+                df[column] = df[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True), file_numbers, rejected_rows
+
+# Remove rows if both conversion_date AND cancellation_date are missing
+def drop_missing_dates(df):
+    return df[~(df['conversion_date'].isna() & df['cancellation_date'].isna())]
+
+# Remove duplicate entries by looking at OID, every row of an OID that appears more than once is dropped.
+# This runs before the geo and feature work so that only surviving rows are processed
+def report_dropped_oids(n_duplicate_rows, n_duplicate_oids, n_missing_oid):
+    print(f"Dropped {n_duplicate_rows} rows sharing {n_duplicate_oids} duplicated OIDs "
+          f"and {n_missing_oid} rows with a missing OID")
+
+def drop_duplicate_oids(df):
+    missing_oid = df['oid'].isna()
+    duplicate_oid = df['oid'].duplicated(keep=False) & ~missing_oid
+    report_dropped_oids(duplicate_oid.sum(), df.loc[duplicate_oid, 'oid'].nunique(), missing_oid.sum())
+    return df[~(duplicate_oid | missing_oid)]
+
+# Across files, an OID keeps only its rows from the last file that exports it, later exports supersede earlier ones.
+# Duplicates within that last file are still dropped by drop_duplicate_oids, as are rows without an OID
+def report_superseded_rows(n_superseded_rows):
+    if n_superseded_rows:
+        print(f"Dropped {n_superseded_rows} rows superseded by a later export of the same OID")
+
+def drop_superseded_rows(df, file_numbers):
+    superseded = (file_numbers < file_numbers.groupby(df['oid']).transform('max')).to_numpy()
+    report_superseded_rows(superseded.sum())
+    return df[~superseded]
+
+# Standardize country names via pycountry and custom mappings for easier readability
+custom_mappings = {
+    'United Kingdom of Great Britain and Northern Ireland': 'United Kingdom',
+    'United States of America': 'United States',
+    'Korea (Republic of)': 'South Korea',
+    'Korea, Republic of': 'South Korea',
+    'Russian Federation': 'Russia',
+    'Türkiye': 'Turkey',
+    'Venezuela, Bolivarian Republic of': 'Venezuela',
+    'Venezuela (Bolivarian Republic of)': 'Venezuela',
+    'Bolivia (Plurinational State of)': 'Bolivia',
+    'Bolivia, Plurinational State of': 'Bolivia',
+    'Macedonia (FYROM)': 'North Macedonia',
+    'Iran, Islamic Republic of': 'Iran',
+    'Lao People\'s Democratic Republic': 'Laos',
+    'Syrian Arab Republic': 'Syria',
+    'United Republic of Tanzania': 'Tanzania',
+    'Taiwan, Province of China': 'Taiwan',
+    'Eswatini': 'Swaziland',
+    "Côte d'Ivoire": 'Ivory Coast',
+    'Bahamas': 'The Bahamas',
+    'Moldova (Republic of)': 'Moldova',
+    'Congo (Democratic Republic of the)': 'Congo',
+    'Viet Nam': 'Vietnam'
+}
+def standardize_country_name(country_name):
+    import pycountry
+    try:
+        standardized_name = pycountry.countries.lookup(country_name).name
+    except LookupError:
+        standardized_name = country_name
+    return custom_mappings.get(standardized_name, standardized_name)
+
+# Map countries to new feature, regions
+country_to_region = {
+    'United States': 'North America',
+    'Canada': 'North America',
+    'Mexico': 'North America',
+    'Brazil': 'Latin America',
+    'Argentina': 'Latin America',
+    'Colombia': 'Latin America',
+    'Chile': 'Latin America',
+    'Peru': 'Latin America',
+    'United Kingdom': 'Europe',
+    'Germany': 'Europe',
+    'France': 'Europe',
+    'Italy': 'Europe',
+    'Spain': 'Europe',
+    'Netherlands': 'Europe',
+    'Belgium': 'Europe',
+    'Switzerland': 'Europe',
+    'Sweden': 'Europe',
+    'Norway': 'Europe',
+    'Denmark': 'Europe',
+    'Finland': 'Europe',
+    'Ireland': 'Europe',
+    'Poland': 'Europe',
+    'Czechia': 'Europe',
+    'Austria': 'Europe',
+    'Hungary': 'Europe',
+    'Portugal': 'Europe',
+    'Greece': 'Europe',
+    'Ukraine': 'Europe',
+    'Russia': 'Europe',
+    'Turkey': 'Europe',
+    'Israel': 'Middle East',
+    'Saudi Arabia': 'Middle East',
+    'United Arab Emirates': 'Middle East',
+    'Qatar': 'Middle East',
+    'Kuwait': 'Middle East',
+    'Oman': 'Middle East',
+    'Jordan': 'Middle East',
+    'Lebanon': 'Middle East',
+    'Egypt': 'Middle East',
+    'South Korea': 'Asia Pacific',
+    'Japan': 'Asia Pacific',
+    'China': 'Asia Pacific',
+    'India': 'Asia Pacific',
+    'Australia': 'Asia Pacific',
+    'New Zealand': 'Asia Pacific',
+    'Taiwan': 'Asia Pacific',
+    'Hong Kong': 'Asia Pacific',
+    'Singapore': 'Asia Pacific',
+    'Malaysia': 'Asia Pacific',
+    'Thailand': 'Asia Pacific',
+    'Indonesia': 'Asia Pacific',
+    'Philippines': 'Asia Pacific',
+    'Vietnam': 'Asia Pacific',
+    'South Africa': 'Africa',
+    'Nigeria': 'Africa',
+    'Kenya': 'Africa',
+    'Morocco': 'Africa',
+    'Algeria': 'Africa',
+    'Tunisia': 'Africa',
+    'Ghana': 'Africa',
+    'Uganda': 'Africa',
+    'Tanzania': 'Africa',
+    'Ethiopia': 'Africa',
+    'Ivory Coast': 'Africa',
+    'Cameroon': 'Africa',
+    'Zambia': 'Africa',
+    'Zimbabwe': 'Africa',
+    'Mozambique': 'Africa',
+    'Luxembourg': 'Europe',
+    'Malta': 'Europe',
+    'Iceland': 'Europe',
+    'Slovenia': 'Europe',
+    'Lithuania': 'Europe',
+    'Slovakia': 'Europe',
+    'Belarus': 'Europe',
+    'Trinidad and Tobago': 'Latin America',
+    'Romania': 'Europe',
+    'Uruguay': 'Latin America',
+    'Croatia': 'Europe',
+    'Estonia': 'Europe',
+    'Dominican Republic': 'Latin America',
+    'Kyrgyzstan': 'Asia Pacific',
+    'Bulgaria': 'Europe',
+    'Cambodia': 'Asia Pacific',
+    'Mongolia': 'Asia Pacific',
+    'Latvia': 'Europe',
+    'Costa Rica': 'Latin America',
+    'Georgia': 'Europe',
+    'Pakistan': 'Asia Pacific',
+    'Sri Lanka': 'Asia Pacific',
+    'Bahrain': 'Middle East',
+    'Albania': 'Europe',
+    'Bosnia and Herzegovina': 'Europe',
+    'Armenia': 'Asia Pacific',
+    'Uzbekistan': 'Asia Pacific',
+    'Ecuador': 'Latin America',
+    'Maldives': 'Asia Pacific',
+    'Cyprus': 'Europe',
+    'North Macedonia': 'Europe',
+    'El Salvador': 'Latin America',
+    'Kazakhstan': 'Asia Pacific',
+    'Azerbaijan': 'Asia Pacific',
+    'Myanmar': 'Asia Pacific',
+    'Guatemala': 'Latin America',
+    'Paraguay': 'Latin America',
+    'Panama': 'Latin America',
+    'Honduras': 'Latin America',
+    'Montenegro': 'Europe',
+    'Brunei Darussalam': 'Asia Pacific',
+    'Jamaica': 'Latin America',
+    'Senegal': 'Africa',
+    'Papua New Guinea': 'Asia Pacific',
+    'Anguilla': 'Latin America',
+    'Moldova': 'Europe',
+    'Bolivia': 'Latin America',
+    'Congo': 'Africa',
+    'Serbia': 'Europe',
+    'Macao': 'Asia Pacific',
+    'Tanzania, United Republic of': 'Africa'
+    # Add more countries as needed
+}
+
+def map_country_to_region(country_name):
+    return country_to_region.get(country_name, 'Other')
+
+# Resolve each distinct country name once and broadcast the result back through the factorized codes, as categories so
+# the rows only hold integer codes. Resolved names are cached on disk as raw name -> (standard name, region) so repeat
+# runs skip pycountry, the cache is discarded whenever custom_mappings or country_to_region change
+country_mappings_version = hashlib.sha1(
+    json.dumps([custom_mappings, country_to_region], sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_country_cache(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('mappings_version') != country_mappings_version:
+        return {}
+    return cache['countries']
+
+def save_country_cache(path, countries):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'mappings_version': country_mappings_version, 'countries': countries}, f, ensure_ascii=False)
+
+def category_from_codes(values, codes):
+    value_codes, categories = pd.factorize(values, sort=True)
+    return pd.Categorical.from_codes(value_codes[codes], categories).remove_unused_categories()
+
+def resolve_countries(country_names, cache):
+    codes, raw_names = pd.factorize(country_names)
+    for name in raw_names:
+        if name not in cache:
+            standardized_name = standardize_country_name(name)
+            cache[name] = [standardized_name, map_country_to_region(standardized_name)]
+
+    # Missing countries (code -1) pick up the trailing NaN / 'Other' entries
+    standardized_names = np.array([cache[name][0] for name in raw_names] + [np.nan], dtype=object)
+    regions = np.array([cache[name][1] for name in raw_names] + ['Other'], dtype=object)
+    return category_from_codes(standardized_names, codes), category_from_codes(regions, codes)
+
+# Months between two dates, used for month_diff and alltime_monthdiff
+# Computed on whole columns, matching relativedelta(end, start).months + .years * 12: the raw month difference
+# borrows a month when the end date falls before the start day-of-month (clipped to the end month's length)
+def calculate_month_diff(end, start):
+    end = pd.to_datetime(end)
+    start = pd.to_datetime(start)
+    months = (end.dt.year - start.dt.year) * 12 + (end.dt.month - start.dt.month)
+    anchor_day = np.minimum(start.dt.day, end.dt.days_in_month)
+    end_key = pd.to_timedelta(end.dt.day, unit='D') + (end - end.dt.normalize())
+    anchor_key = pd.to_timedelta(anchor_day, unit='D') + (start - start.dt.normalize())
+    months = months - ((end >= start) & (end_key < anchor_key)) + ((end < start) & (end_key > anchor_key))
+    return months.astype('Int64')
+
+# Add geography, free trial, month difference and MRR features. The clean step times the country lookups as a stage of
+# their own, add_geography then add_subscription_features, add_features runs both
+def add_geography(df, country_cache):
+    df['personal_person_geo_country'], df['country_region'] = resolve_countries(
+        df['personal_person_geo_country'], country_cache)
+    return df
+
+def add_subscription_features(df, as_of_date):
+    # Add and determine if a customer had a free trial, we are assuming if conversion date != start date, customer had a free trial
+    df['free_trial'] = ~((df['signup_date'] == df['conversion_date']) | df['conversion_date'].isna())
+
+    # Add and calculate how many months were between start date and cancellation date
+    df['month_diff'] = calculate_month_diff(df['cancellation_date'], df['signup_date'])
+
+    # Calculate month difference for customers who have not cancelled, up to the as-of date of the run
+    df['alltime_monthdiff'] = df['month_diff'].fillna(
+        calculate_month_diff(pd.Series(as_of_date, index=df.index), df['signup_date']))
+
+    # Calculate MRR for customers who have cancelled and backfilling accordingly
+    alltime_monthdiff = df['alltime_monthdiff'].astype('float64')
+    df['alltime_MRR'] = np.where(df['current_mrr'] != 0, df['current_mrr'],
+                                 np.where(alltime_monthdiff != 0, df['total_charges'] / alltime_monthdiff, 0))
+    return df
+
+def add_features(df, country_cache, as_of_date):
+    return add_subscription_features(add_geography(df, country_cache), as_of_date)
+
+# Typed copy of the cleaned data that the analysis scripts load. Dates stay datetimes, month counts stay Int64 and
+# low cardinality text columns are stored as categories with a fixed index width so streamed chunks share one schema
+category_columns = ['personal_person_geo_country', 'country_region', 'provider']
+
+def to_arrow_table(df):
+    df = df.astype({'cancellation_date': 'datetime64[ns]', **dict.fromkeys(category_columns, 'category')})
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in category_columns:
+        table = table.set_column(table.schema.get_field_index(column), column,
+                                 table[column].cast(pa.dictionary(pa.int32(), pa.string())))
+    return table
+
+# Cleaned Parquet output. With partition_columns it is a hive-partitioned directory at cleaned_parquet_path
+# (country_region=Europe/part-0-0.parquet, ...) so the analysis can skip whole partitions, the partition directories of
+# the previous run are removed first. part numbers the files of each streamed chunk. Partition values are read back from
+# the directory names as text, so only text columns can be partitioned by, a bool or number column would come back as
+# the strings 'true' or '12.5'
+partition_column_names = [column for column, dtype in customer_schema.items() if dtype == 'string'] + category_columns
+
+def check_partition_columns(partition_columns):
+    invalid_columns = [column for column in partition_columns if column not in partition_column_names]
+    if invalid_columns:
+        raise ValueError(f"Cannot partition by {', '.join(invalid_columns)}, only by the text columns "
+                         f"{', '.join(partition_column_names)}")
+
+def clear_partitions(dataset_path, partition_columns):
+    for partition_path in glob.glob(os.path.join(glob.escape(dataset_path), f'{partition_columns[0]}=*')):
+        shutil.rmtree(partition_path)
+
+def write_partitions(table, dataset_path, partition_columns, part=0):
+    ds.write_dataset(table, dataset_path, format='parquet', partitioning=list(partition_columns),
+                     partitioning_flavor='hive', basename_template=f'part-{part}-{{i}}.parquet',
+                     existing_data_behavior='overwrite_or_ignore')
+
+# Every file is read, stripped and parsed in parallel when there are several, each timed as a stage
+def clean_customer_file(file_path, cleaned_file_path, cleaned_parquet_path, country_cache, as_of_date,
+                        profiler=disabled_profiler, rejected_file_path=None, read_workers=4, partition_columns=()):
+    files = customer_files(file_path)
+    df, file_numbers, rejected_rows = read_customer_files(files, read_workers, profiler)
+    write_rejected_rows(rejected_rows, rejected_file_path)
+    report_rejected_rows(len(rejected_rows), rejected_file_path)
+    with profiler.stage('drop_missing_dates', len(df)) as stage:
+        df = drop_missing_dates(df)
+        stage.rows_out = len(df)
+    with profiler.stage('dedup', len(df)) as stage:
+        if len(files) > 1:
+            df = drop_superseded_rows(df, file_numbers.loc[df.index])
+        df = drop_duplicate_oids(df)
+        stage.rows_out = len(df)
+    with profiler.stage('geo', len(df)):
+        df = add_geography(df, country_cache)
+    with profiler.stage('features', len(df)):
+        df = add_subscription_features(df, as_of_date)
+
+    # Export to local CSV and Parquet
+    with profiler.stage('write_csv', len(df)):
+        df.to_csv(cleaned_file_path, index=False)
+    with profiler.stage('write_parquet', len(df)):
+        if partition_columns:
+            clear_partitions(cleaned_parquet_path, partition_columns)
+            write_partitions(to_arrow_table(df), cleaned_parquet_path, partition_columns)
+        else:
+            pq.write_table(to_arrow_table(df), cleaned_parquet_path)
+
+# Streaming mode
+# Every chunk is typed by the customer schema, so numbers, dates and strings are written exactly as the in-memory
+# run writes them. Dates carry a time of day in the CSV only when some row of the whole column has one
+def format_datetimes(df, columns_with_time):
+    for column in columns_with_time:
+        date_format = '%Y-%m-%d %H:%M:%S' if columns_with_time[column] else '%Y-%m-%d'
+        df[column] = df[column].dt.strftime(date_format)
+    return df
+
+# Chunks of every file in turn with the number of the file they came from
+def customer_chunks(files, chunk_size):
+    for file_number, file_path in enumerate(files):
+        for chunk in read_customer_chunks(file_path, chunk_size):
+            yield file_number, chunk
+
+# OID uniqueness is the one global step. The first pass spills the OIDs of every row that survives the date
+# filter into hash partitions on disk, each partition is then small enough to find its duplicates in memory.
+# The file each row came from and whether it carries a time of day are spilled alongside, as they decide which rows
+# a later export supersedes and how dates are written. Superseded OIDs come back with the last file exporting them
+def scan_customer_files(files, spill_dir, chunk_size, n_partitions=64):
+    datetime_columns = ['signup_date', 'conversion_date']
+    n_missing_oid = 0
+    for file_number, chunk in customer_chunks(files, chunk_size):
+        chunk, _ = apply_schema(strip_whitespace(chunk))
+        chunk = drop_missing_dates(chunk)
+        n_missing_oid += chunk['oid'].isna().sum()
+        chunk = chunk[chunk['oid'].notna()]
+        spill = pd.DataFrame({column: chunk[column] > chunk[column].dt.normalize() for column in datetime_columns})
+        spill.insert(0, 'oid', chunk['oid'])
+        spill.insert(1, 'file_number', file_number)
+        partitions = pd.util.hash_pandas_object(spill['oid'], index=False).to_numpy() % n_partitions
+        for partition, partition_spill in spill.groupby(partitions):
+            partition_spill.to_csv(os.path.join(spill_dir, f'oids_{partition}.csv'), mode='a', header=False, index=False)
+
+    duplicate_oids = set()
+    latest_files = []
+    n_duplicate_rows = 0
+    n_superseded_rows = 0
+    columns_with_time = {column: False for column in datetime_columns}
+    for partition in range(n_partitions):
+        partition_path = os.path.join(spill_dir, f'oids_{partition}.csv')
+        if not os.path.exists(partition_path):
+            continue
+        spill = pd.read_csv(partition_path, header=None, names=['oid', 'file_number'] + datetime_columns,
+                            dtype={'oid': str}, keep_default_na=False)
+        latest_file = spill.groupby('oid')['file_number'].transform('max')
+        superseded = spill['file_number'] < latest_file
+        latest_files.append(latest_file[superseded].groupby(spill.loc[superseded, 'oid']).first())
+        n_superseded_rows += superseded.sum()
+        spill = spill[~superseded]
+        duplicate_oid = spill['oid'].duplicated(keep=False)
+        duplicate_oids.update(spill.loc[duplicate_oid, 'oid'])
+        n_duplicate_rows += duplicate_oid.sum()
+        for column in datetime_columns:
+            columns_with_time[column] |= bool(spill.loc[~duplicate_oid, column].any())
+    report_superseded_rows(n_superseded_rows)
+    report_dropped_oids(n_duplicate_rows, len(duplicate_oids), n_missing_oid)
+    latest_files = pd.concat(latest_files) if latest_files else pd.Series(dtype='float64')
+    return columns_with_time, duplicate_oids, latest_files
+
+# Stages are timed over the whole first pass and then per chunk, adding up across chunks. Rejected rows are written
+# by the second pass only. Files are read one chunk at a time, one after the other, to keep memory bounded
+def stream_clean_customer_file(file_path, cleaned_file_path, cleaned_parquet_path, country_cache, as_of_date,
+                               chunk_size=500_000, profiler=disabled_profiler, rejected_file_path=None,
+                               partition_columns=()):
+    files = customer_files(file_path)
+    with profiler.stage('scan'), tempfile.TemporaryDirectory() as spill_dir:
+        columns_with_time, duplicate_oids, latest_files = scan_customer_files(files, spill_dir, chunk_size)
+
+    header = True
+    schema = None
+    parquet_writer = None
+    n_rejected_rows = 0
+    for chunk_number, (file_number, chunk) in enumerate(customer_chunks(files, chunk_size)):
+        with profiler.stage('strip', len(chunk)):
+            chunk = strip_whitespace(chunk)
+        with profiler.stage('parse', len(chunk)) as stage:
+            chunk, rejected_rows = apply_schema(chunk)
+            write_rejected_rows(rejected_rows.assign(source_file=files[file_number]), rejected_file_path, header)
+            n_rejected_rows += len(rejected_rows)
+            stage.rows_out = len(chunk)
+        with profiler.stage('filter', len(chunk)) as stage:
+            chunk = drop_missing_dates(chunk)
+            superseded = (chunk['oid'].map(latest_files) > file_number).to_numpy()
+            chunk = chunk[~(superseded | chunk['oid'].isna() | chunk['oid'].isin(duplicate_oids))]
+            stage.rows_out = len(chunk)
+        with profiler.stage('geo', len(chunk)):
+            chunk = add_geography(chunk, country_cache)
+        with profiler.stage('features', len(chunk)):
+            chunk = add_subscription_features(chunk, as_of_date)
+
+        # A column that is entirely missing in the first chunk is typed as text for the whole file
+        with profiler.stage('write_parquet', len(chunk)):
+            table = to_arrow_table(chunk)
+            if schema is None:
+                schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                                    for field in table.schema], metadata=table.schema.metadata)
+                if partition_columns:
+                    clear_partitions(cleaned_parquet_path, partition_columns)
+                else:
+                    parquet_writer = pq.ParquetWriter(cleaned_parquet_path, schema)
+            if partition_columns:
+                write_partitions(table.cast(schema), cleaned_parquet_path, partition_columns, chunk_number)
+            else:
+                parquet_writer.write_table(table.cast(schema))
+
+        with profiler.stage('write_csv', len(chunk)):
+            chunk = format_datetimes(chunk, columns_with_time)
+            chunk.to_csv(cleaned_file_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    if parquet_writer is not None:
+        parquet_writer.close()
+    report_rejected_rows(n_rejected_rows, rejected_file_path)
+
+# The whole clean step as the script and the command line run it, over one export or all files matching file_path.
+# Streaming processes the files chunk_size rows at a time so memory stays bounded, the output is identical (the Parquet
+# categories are in the order the chunks first met them rather than sorted), otherwise read_workers threads read the
+# files in parallel. Countries resolved for the first time are added to the country cache at country_cache_path, None
+# resolves every country without a cache. Rows that do not match the customer schema are written to
+# rejected_file_path. partition_columns writes the Parquet output partitioned by those text columns
+def run_clean(file_path, cleaned_file_path, cleaned_parquet_path, as_of_date, country_cache_path=None, stream=False,
+              chunk_size=500_000, profiler=disabled_profiler, rejected_file_path=None, read_workers=4,
+              partition_columns=()):
+    check_partition_columns(partition_columns)
+    country_cache = load_country_cache(country_cache_path) if country_cache_path else {}
+    n_cached_countries = len(country_cache)
+    if stream:
+        stream_clean_customer_file(file_path, cleaned_file_path, cleaned_parquet_path, country_cache, as_of_date,
+                                   chunk_size, profiler, rejected_file_path, partition_columns)
+    else:
+        clean_customer_file(file_path, cleaned_file_path, cleaned_parquet_path, country_cache, as_of_date, profiler,
+                            rejected_file_path, read_workers, partition_columns)
+    if country_cache_path and len(country_cache) > n_cached_countries:
+        save_country_cache(country_cache_path, country_cache)
@@ -0,0 +1,167 @@
+#This module is the retention command line: 'retention clean' cleans a raw customer export, 'curves', 'cohorts' and 'segments' write the retention tables as CSV files and 'report' renders every figure to image files. Each command imports only what it runs, so the table commands never load matplotlib and pycountry is only loaded when clean meets a country name that is not in its cache
+
+import os
+import sys
+import argparse
+from datetime import datetime
+from retention.config import run_config, load_run_config
+from retention.periods import period_names
+from retention.profile import StageProfiler
+
+# Run config from --config (or RETENTION_CONFIG, or the defaults) with the options given on the command line on top
+def command_config(args):
+    config = load_run_config(args.config) if args.config else run_config
+    overrides = {'horizon': args.horizon, 'granularity': args.granularity, 'as_of_date': args.as_of}
+    return config._replace(**{field: value for field, value in overrides.items() if value is not None})
+
+def command_profiler(args):
+    return StageProfiler(args.profile is not None, args.profile, args.profile_memory, args.profile_stage)
+
+def write_tables(tables, output_dir, index=False):
+    os.makedirs(output_dir, exist_ok=True)
+    for name, table in tables.items():
+        path = os.path.join(output_dir, f'{name}.csv')
+        table.to_csv(path, index=index)
+        print(path)
+
+# Any column of the cleaned file can be a cut, a column it does not have stops the command before anything is computed
+def check_cuts(args):
+    import pyarrow.dataset as ds
+    columns = ds.dataset(args.input, format='parquet', partitioning='hive').schema.names
+    unknown_cuts = [cut for cut in args.cuts if cut not in columns]
+    if unknown_cuts:
+        sys.exit(f"retention: {args.input} has no column {', '.join(unknown_cuts)}, its columns are {', '.join(columns)}")
+
+def run_clean_command(args):
+    from retention.clean import run_clean
+    config = command_config(args)
+    profiler = command_profiler(args)
+    try:
+        run_clean(args.input, args.csv, args.parquet, config.as_of_date, args.country_cache, args.stream,
+                  args.chunk_size, profiler, args.rejects, args.read_workers, args.partition_by)
+    except ValueError as error:
+        sys.exit(f'retention: {error}')
+    profiler.write_report({'command': 'clean', 'input': args.input, 'stream_mode': args.stream,
+                           'run_config': config._asdict()})
+
+def run_curves_command(args):
+    from retention.analysis import compute_retention_results, curve_table
+    config = command_config(args)
+    profiler = command_profiler(args)
+    results = compute_retention_results(args.input, config, args.cache_dir, profiler=profiler, compact=args.compact,
+                                        out_of_core=args.out_of_core)
+    period_name = period_names[config.granularity]
+    write_tables({'revenue_retention_curve': curve_table(results.revenue_curve, period_name),
+                  'customer_retention_curve': curve_table(results.customer_curve, period_name)}, args.output_dir)
+    profiler.write_report({'command': 'curves', 'input': args.input, 'run_config': config._asdict()})
+
+def run_cohorts_command(args):
+    from retention.analysis import compute_retention_results, cohort_tables
+    config = command_config(args)
+    profiler = command_profiler(args)
+    results = compute_retention_results(args.input, config, args.cache_dir, profiler=profiler, compact=args.compact,
+                                        out_of_core=args.out_of_core)
+    tables = cohort_tables(results, config.horizon)
+    write_tables({f'{name}_by_cohort': table for name, table in tables._asdict().items()}, args.output_dir, index=True)
+    profiler.write_report({'command': 'cohorts', 'input': args.input, 'run_config': config._asdict()})
+
+def run_segments_command(args):
+    from retention.segments import compute_segmented_retention, segment_table
+    check_cuts(args)
+    config = command_config(args)
+    profiler = command_profiler(args)
+    segmented_retention = compute_segmented_retention(args.input, config, args.cuts, args.exclude_regions, args.workers,
+                                                      args.cache_dir, profiler=profiler, compact=args.compact,
+                                                      out_of_core=args.out_of_core)
+    write_tables({'segment_retention': segment_table(segmented_retention, period_names[config.granularity])},
+                 args.output_dir)
+    profiler.write_report({'command': 'segments', 'input': args.input, 'run_config': config._asdict()})
+
+def run_report_command(args):
+    from retention.analysis import compute_retention_results
+    from retention.segments import compute_segmented_retention, segment_cut_names
+    from retention.report import plot_retention_report, plot_segment_report
+    from retention.render import FigureRenderer
+    check_cuts(args)
+    config = command_config(args)
+    profiler = command_profiler(args)
+    period_name = period_names[config.granularity]
+    results = compute_retention_results(args.input, config, args.cache_dir, profiler=profiler.step('analysis'),
+                                        compact=args.compact, out_of_core=args.out_of_core)
+    segmented_retention = compute_segmented_retention(args.input, config, args.cuts, args.exclude_regions, args.workers,
+                                                      args.cache_dir, profiler=profiler.step('segments'),
+                                                      compact=args.compact, out_of_core=args.out_of_core)
+
+    profiler.begin('render')
+    renderer = FigureRenderer('batch', args.output_dir, args.formats, args.render_workers)
+    plot_retention_report(results, config.horizon, period_name, renderer, args.cohorts_per_page)
+    plot_segment_report(segmented_retention, {cut: segment_cut_names.get(cut, cut) for cut in args.cuts},
+                        config.horizon, period_name, renderer)
+    renderer.close()
+    profiler.end('render')
+    profiler.write_report({'command': 'report', 'input': args.input, 'run_config': config._asdict()})
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--config', help='JSON run config file, as for RETENTION_CONFIG')
+    common.add_argument('--horizon', type=int, help='periods since signup covered by every table and figure')
+    common.add_argument('--granularity', choices=sorted(period_names), help='W, M or Q cohorts and periods')
+    common.add_argument('--as-of', type=datetime.fromisoformat, help='date customers who have not cancelled are measured up to')
+    common.add_argument('--profile', metavar='REPORT', help='write a JSON report of every stage to REPORT')
+    common.add_argument('--profile-memory', action='store_true', help='add traced peak memory to the profile report')
+    common.add_argument('--profile-stage', help='run this stage under cProfile, e.g. segments.load for report')
+
+    analysis = argparse.ArgumentParser(add_help=False, parents=[common])
+    analysis.add_argument('input', help='cleaned Parquet file written by retention clean')
+    analysis.add_argument('--cache-dir', help='reuse results cached here for unchanged data')
+    analysis.add_argument('--compact', action='store_true', help='load the data in a compact form to bound memory')
+    analysis.add_argument('--out-of-core', action='store_true', help='scan the data in batches instead of loading it')
+
+    segments = argparse.ArgumentParser(add_help=False)
+    segments.add_argument('--cuts', nargs='+', default=['country_region', 'provider', 'free_trial'],
+                          help='columns of the cleaned file to cut by')
+    segments.add_argument('--exclude-regions', nargs='*', default=['Other'], help='country regions left out of every cut')
+    segments.add_argument('--workers', type=int, default=1, help='processes computing the segments')
+
+    parser = argparse.ArgumentParser(prog='retention', description='Customer and revenue retention analysis')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    clean = commands.add_parser('clean', parents=[common], help='clean a raw customer export')
+    clean.add_argument('input', help='raw customer CSV or Parquet export, a directory of exports or a glob pattern')
+    clean.add_argument('--csv', required=True, help='cleaned CSV file to write')
+    clean.add_argument('--parquet', required=True, help='cleaned Parquet file to write, a directory with --partition-by')
+    clean.add_argument('--partition-by', nargs='+', default=[], help='hive-partition the Parquet output by these text columns')
+    clean.add_argument('--read-workers', type=int, default=4, help='threads reading the input files')
+    clean.add_argument('--rejects', help='CSV file the rows that do not match the customer schema are written to')
+    clean.add_argument('--country-cache', help='JSON cache of resolved country names')
+    clean.add_argument('--stream', action='store_true', help='process the file in chunks to bound memory')
+    clean.add_argument('--chunk-size', type=int, default=500_000, help='rows per chunk when streaming')
+    clean.set_defaults(run=run_clean_command)
+
+    curves = commands.add_parser('curves', parents=[analysis], help='overall revenue and customer retention curves')
+    curves.add_argument('--output-dir', default='.', help='directory the CSV tables are written to')
+    curves.set_defaults(run=run_curves_command)
+
+    cohorts = commands.add_parser('cohorts', parents=[analysis], help='retention and losses by cohort and period')
+    cohorts.add_argument('--output-dir', default='.', help='directory the CSV tables are written to')
+    cohorts.set_defaults(run=run_cohorts_command)
+
+    segment = commands.add_parser('segments', parents=[analysis, segments], help='retention curves of every segment')
+    segment.add_argument('--output-dir', default='.', help='directory the CSV table is written to')
+    segment.set_defaults(run=run_segments_command)
+
+    report = commands.add_parser('report', parents=[analysis, segments], help='render every table and figure')
+    report.add_argument('--output-dir', default='retention_figures', help='directory the figures are written to')
+    report.add_argument('--formats', nargs='+', default=['png'], choices=['png', 'svg', 'pdf'], help='figure formats')
+    report.add_argument('--render-workers', type=int, default=4, help='processes saving figures')
+    report.add_argument('--cohorts-per-page', type=int, help='split cohort heatmaps into pages of this many cohorts')
+    report.set_defaults(run=run_report_command)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#This module loads the cleaned data for the analysis in a compact form built batch by batch straight from the Parquet file. Dates are reduced to int32 day numbers and from those to the cohort and Int16 periods since signup, MRR is float32, text columns are categories and booleans are bit-packed, so tens of millions of customers fit in a few GB where the full load needs several times that
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+from retention.periods import build_day_index, signup_cohorts, periods_between
+from retention.profile import disabled_profiler
+
+# Periods since signup are clipped to the int16 range, thousands of periods past any horizon, which no curve or
+# aggregate can tell apart
+period_limits = np.iinfo('int16')
+
+def compact_periods(periods):
+    values = np.clip(periods.to_numpy(dtype='int64', na_value=0), period_limits.min, period_limits.max)
+    return pd.arrays.IntegerArray(values.astype('int16'), periods.isna())
+
+# Any other column keeps its values in the smallest form that holds them: floats as float32, booleans as Arrow booleans
+# (one bit per row), dictionary-encoded text as categories, other text (the OID) as Arrow strings and integers as they are
+def compact_column(values):
+    if pa.types.is_floating(values.type):
+        return values.to_numpy(zero_copy_only=False).astype('float32')
+    if pa.types.is_boolean(values.type) or pa.types.is_string(values.type):
+        return pd.arrays.ArrowExtensionArray(values)
+    if pa.types.is_dictionary(values.type):
+        return pd.Categorical(values.to_pandas())
+    return values.to_pandas()
+
+# Signup and cancellation dates are only held a batch at a time, as day numbers, and replaced by cohort, period_diff and
+# alltime_perioddiff exactly as add_signup_periods derives them
+def compact_batch(batch, config):
+    signup = build_day_index(batch.column('signup_date').to_numpy(zero_copy_only=False))
+    cancellation = build_day_index(batch.column('cancellation_date').to_numpy(zero_copy_only=False))
+    as_of = build_day_index([config.as_of_date])
+    period_diff = pd.Series(periods_between(signup, cancellation, config.granularity))
+    alltime_perioddiff = period_diff.fillna(pd.Series(periods_between(signup, as_of, config.granularity)))
+    frame = {column: compact_column(batch.column(column)) for column in batch.schema.names
+             if column not in ('signup_date', 'cancellation_date')}
+    frame.update({'cohort': signup_cohorts(signup, config.granularity),
+                  'period_diff': compact_periods(period_diff.array),
+                  'alltime_perioddiff': compact_periods(alltime_perioddiff.array)})
+    return pd.DataFrame(frame)
+
+# Batches are stacked with the categories of each text column merged across them
+def stack_batches(frames):
+    for column in frames[0].columns:
+        if isinstance(frames[0][column].dtype, pd.CategoricalDtype) and len(frames) > 1:
+            categories = union_categoricals([frame[column] for frame in frames]).categories
+            for frame in frames:
+                frame[column] = frame[column].cat.set_categories(categories)
+    return pd.concat(frames, ignore_index=True)
+
+# Compact counterpart of load_retention_data, the same rows with the same cohorts and periods. The cleaned file may be a
+# hive-partitioned directory, filters skip partitions as they do there. columns must include signup_date and
+# cancellation_date
+def load_compact_retention_data(file_path, columns, config, profiler=disabled_profiler, filters=None,
+                                batch_size=1_000_000):
+    with profiler.stage('load') as stage:
+        dataset = ds.dataset(file_path, format='parquet', partitioning='hive')
+        batches = dataset.to_batches(columns=list(columns), batch_size=batch_size,
+                                     filter=pq.filters_to_expression(filters) if filters else None)
+        frames = [compact_batch(batch, config) for batch in batches if batch.num_rows]
+        if not frames:
+            fields = [dataset.schema.field(column) for column in columns]
+            empty_batch = pa.RecordBatch.from_arrays([pa.array([], type=field.type) for field in fields],
+                                                     schema=pa.schema(fields))
+            frames = [compact_batch(empty_batch, config)]
+        df = stack_batches(frames)
+        stage.rows_in = stage.rows_out = len(df)
+    return df
@@ -0,0 +1,24 @@
+#This module holds the run configuration shared by the clean and analysis scripts, so the horizon, as-of date and granularity are set in one place instead of in each script
+
+import os
+import json
+from collections import namedtuple
+from datetime import datetime
+
+# granularity is the period customers are grouped into cohorts by and retention is bucketed by, 'W' for weeks, 'M' for
+# months or 'Q' for quarters. horizon is the number of those periods since signup covered by every curve, table and
+# heatmap. as_of_date is the date customers who have not cancelled are measured up to
+RunConfig = namedtuple('RunConfig', ['horizon', 'as_of_date', 'granularity'])
+run_config = RunConfig(horizon=21, as_of_date=datetime(2023, 1, 30), granularity='M')
+
+# Fields given in a JSON file replace the defaults above, e.g. {"as_of_date": "2022-12-31", "horizon": 12}
+def load_run_config(path):
+    with open(path) as file:
+        settings = json.load(file)
+    if 'as_of_date' in settings:
+        settings['as_of_date'] = datetime.fromisoformat(settings['as_of_date'])
+    return run_config._replace(**settings)
+
+# Scheduled runs point RETENTION_CONFIG at a config file instead of editing the scripts
+if os.environ.get('RETENTION_CONFIG'):
+    run_config = load_run_config(os.environ['RETENTION_CONFIG'])
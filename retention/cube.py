@@ -0,0 +1,62 @@
+#This module holds the retention cube, lost revenue, lost users, initial MRR and user counts precomputed over signup cohort, region, provider and free trial and saved as an .npz file, so any combination of cuts can be sliced or rolled up from the saved cube without rescanning the customer rows
+
+import numpy as np
+import pandas as pd
+
+# Dimensions of the cube. users and initial_MRR are indexed by these, lost_users and lost_revenue carry a trailing
+# periods since signup axis with period 1 first
+cube_dimensions = ['cohort', 'country_region', 'provider', 'free_trial']
+
+# Every customer lands in exactly one cell, missing values get a 'nan' label of their own so roll-ups still add up
+# to the whole customer base. Revenue measures skip customers without an MRR, as the analysis scripts do
+def build_retention_cube(df, max_periods):
+    codes, labels = [], {}
+    for dimension in cube_dimensions:
+        dimension_codes, dimension_labels = pd.factorize(df[dimension], sort=True, use_na_sentinel=False)
+        codes.append(dimension_codes)
+        labels[dimension] = np.array([str(label) for label in dimension_labels])
+    shape = tuple(len(labels[dimension]) for dimension in cube_dimensions)
+    n_cells = int(np.prod(shape))
+    cells = np.ravel_multi_index(codes, shape)
+
+    period_diff = df['period_diff'].to_numpy(dtype='float64', na_value=np.nan)
+    alltime_MRR = df['alltime_MRR'].to_numpy(dtype='float64', na_value=np.nan)
+    has_revenue = ~np.isnan(alltime_MRR)
+    lost = (period_diff >= 1) & (period_diff <= max_periods)
+    lost_cells = cells * max_periods + np.where(lost, period_diff, 1).astype(int) - 1
+
+    cube = {
+        'users': np.bincount(cells, minlength=n_cells).reshape(shape),
+        'initial_MRR': np.bincount(cells[has_revenue], weights=alltime_MRR[has_revenue],
+                                   minlength=n_cells).reshape(shape),
+        'lost_users': np.bincount(lost_cells[lost], minlength=n_cells * max_periods).reshape(shape + (max_periods,)),
+        'lost_revenue': np.bincount(lost_cells[lost & has_revenue], weights=alltime_MRR[lost & has_revenue],
+                                    minlength=n_cells * max_periods).reshape(shape + (max_periods,)),
+    }
+    return cube, labels
+
+def save_retention_cube(path, cube, labels):
+    np.savez_compressed(path, **cube, **{f'{dimension}_labels': labels[dimension] for dimension in cube_dimensions})
+
+def load_retention_cube(path):
+    with np.load(path) as saved:
+        cube = {measure: saved[measure] for measure in ['users', 'initial_MRR', 'lost_users', 'lost_revenue']}
+        labels = {dimension: saved[f'{dimension}_labels'] for dimension in cube_dimensions}
+    return cube, labels
+
+# Slice and roll up the cube. filters keeps only the listed labels of a dimension, and every dimension not in by is
+# summed away, so the result is indexed by the by dimensions in cube order (then periods for the lost measures)
+def roll_up(cube, labels, measure, by=(), filters=None):
+    values = cube[measure]
+    for dimension, keep in (filters or {}).items():
+        axis = cube_dimensions.index(dimension)
+        values = np.take(values, np.flatnonzero(np.isin(labels[dimension], keep)), axis=axis)
+    summed_axes = tuple(axis for axis, dimension in enumerate(cube_dimensions) if dimension not in by)
+    return values.sum(axis=summed_axes)
+
+def calculate_cube_retention(cube, labels, by=(), filters=None, revenue=True):
+    initial = roll_up(cube, labels, 'initial_MRR' if revenue else 'users', by, filters)
+    lost = roll_up(cube, labels, 'lost_revenue' if revenue else 'lost_users', by, filters)
+    remaining = initial[..., None] - np.cumsum(lost, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (remaining / initial[..., None]) * 100
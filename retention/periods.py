@@ -0,0 +1,72 @@
+#This module derives cohorts and the number of periods since signup at weekly, monthly or quarterly granularity from integer day numbers, so the analysis scripts can switch granularity without re-parsing dates or rerunning the clean step
+
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+# Names used for axes and tables at each granularity
+period_names = {'W': 'Week', 'M': 'Month', 'Q': 'Quarter'}
+
+ns_per_day = 86_400 * 10**9
+
+# Every date is reduced once to its day number since 1970-01-01 and the nanoseconds past midnight, the time of day only
+# breaks ties the way relativedelta does when the end falls on the same day of the month as the start
+DayIndex = namedtuple('DayIndex', ['days', 'time', 'missing'])
+
+def build_day_index(dates):
+    ns = np.asarray(dates, dtype='datetime64[ns]').view('int64')
+    missing = ns == np.iinfo('int64').min
+    days = np.where(missing, 0, ns // ns_per_day)
+    return DayIndex(days.astype('int32'), np.where(missing, 0, ns - days * ns_per_day), missing)
+
+# Months since 1970-01 of each day number, with the day of the month and the length of that month
+def month_parts(days):
+    months = days.astype('datetime64[D]').astype('datetime64[M]')
+    month_start = months.astype('datetime64[D]').astype('int64')
+    days_in_month = (months + 1).astype('datetime64[D]').astype('int64') - month_start
+    return months.astype('int64'), days - month_start + 1, days_in_month
+
+# Period ordinals of each day, the same numbers pandas uses for Period('...', freq). Weeks end on Sunday and 1970-01-01
+# is a Thursday in week 1, months and quarters count from 1970-01 and 1970Q1
+def period_ordinals(days, granularity):
+    if granularity == 'W':
+        return (days.astype('int64') + 3) // 7 + 1
+    months = month_parts(days)[0]
+    return months if granularity == 'M' else months // 3
+
+def signup_cohorts(signup, granularity):
+    ordinals = np.where(signup.missing, np.iinfo('int64').min, period_ordinals(signup.days, granularity))
+    return pd.arrays.PeriodArray(ordinals, dtype=pd.PeriodDtype(granularity))
+
+# Whole periods from start to end. Weeks are whole 7 day spans, months follow relativedelta (a month is complete on the
+# same day of the month, or the month's last day when it is shorter) and quarters are whole 3 month spans. Spans ending
+# before the start differ by granularity. Weeks are floored, so they are negative and never land in period 0. Months
+# truncate toward zero like relativedelta, and quarters floor those months, so a cancellation less than a month before
+# signup lands in period 0 at M and Q (counted as a period 0 cancellation in the cohort tables) but not at W
+def periods_between(start, end, granularity):
+    end_days, start_days = end.days.astype('int64'), start.days.astype('int64')
+    if granularity == 'W':
+        periods = (end_days - start_days - (end.time < start.time)) // 7
+    else:
+        end_months, end_day, end_days_in_month = month_parts(end_days)
+        start_months, start_day, _ = month_parts(start_days)
+        anchor_day = np.minimum(start_day, end_days_in_month)
+        end_before_anchor = (end_day < anchor_day) | ((end_day == anchor_day) & (end.time < start.time))
+        end_after_anchor = (end_day > anchor_day) | ((end_day == anchor_day) & (end.time > start.time))
+        ends_after_start = (end_days > start_days) | ((end_days == start_days) & (end.time >= start.time))
+        periods = end_months - start_months - (ends_after_start & end_before_anchor) + (~ends_after_start & end_after_anchor)
+        if granularity == 'Q':
+            periods = periods // 3
+    missing = np.broadcast_to(start.missing | end.missing, periods.shape)
+    return pd.arrays.IntegerArray(periods, missing.copy())
+
+# Adds cohort (signup period), period_diff (periods from signup to cancellation) and alltime_perioddiff (to cancellation,
+# or to the as-of date for customers who have not cancelled) at the given granularity
+def add_signup_periods(df, granularity, as_of_date):
+    signup = build_day_index(df['signup_date'])
+    cancellation = build_day_index(df['cancellation_date'])
+    as_of = build_day_index([as_of_date])
+    df['cohort'] = signup_cohorts(signup, granularity)
+    df['period_diff'] = periods_between(signup, cancellation, granularity)
+    df['alltime_perioddiff'] = df['period_diff'].fillna(pd.Series(periods_between(signup, as_of, granularity), index=df.index))
+    return df
@@ -0,0 +1,167 @@
+#This module times the stages of the clean step and the analysis scripts, recording wall time, CPU time, rows in and out and peak memory of every stage into a JSON run report, with an optional cProfile or pyinstrument profile of one stage
+
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from types import SimpleNamespace
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Peak resident memory of the process so far. psutil gives the peak working set on Windows and only the current RSS
+# elsewhere, without psutil ru_maxrss is used where it exists (kilobytes, bytes on macOS). None when neither is available
+def peak_rss_bytes():
+    if psutil is not None:
+        memory = psutil.Process().memory_info()
+        return getattr(memory, 'peak_wset', memory.rss)
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    return None
+
+def add_rows(total, rows):
+    if rows is None:
+        return total
+    return (total or 0) + rows
+
+# Stages run one after the other, never nested. A stage that runs several times (once per chunk when streaming) adds up
+# its times and rows over every call and keeps the highest peak. Peak traced memory is what Python and numpy allocate
+# during the stage, tracing slows pure Python code down a lot so it is off unless trace_memory is set. Peak RSS is the
+# process high-water mark at the end of the stage, the stage that raises it is the one that needed the memory.
+# profile_stage names one stage to run under cProfile, or pyinstrument when profile_tool is 'pyinstrument'.
+# A disabled profiler does no measuring at all, stage() hands back the same empty context every time
+disabled_stage = nullcontext(SimpleNamespace(rows_in=None, rows_out=None))
+
+class StageProfiler:
+    def __init__(self, enabled=False, report_path=None, trace_memory=False, profile_stage=None, profile_tool='cprofile'):
+        self.enabled = enabled
+        self.report_path = report_path
+        self.trace_memory = trace_memory
+        self.profile_stage = profile_stage
+        self.profile_tool = profile_tool
+        self.stages = {}
+        self.open_stage = None
+        self.stage_profile = None
+        self.started = datetime.now()
+
+    def begin(self, name, rows_in=None):
+        if not self.enabled:
+            return
+        if name == self.profile_stage:
+            if self.stage_profile is None:
+                if self.profile_tool == 'pyinstrument':
+                    from pyinstrument import Profiler
+                    self.stage_profile = Profiler()
+                else:
+                    self.stage_profile = cProfile.Profile()
+            if self.profile_tool == 'pyinstrument':
+                self.stage_profile.start()
+            else:
+                self.stage_profile.enable()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.open_stage = (name, rows_in, time.perf_counter(), time.process_time())
+
+    def end(self, name, rows_out=None, rows_in=None):
+        if not self.enabled:
+            return
+        wall_seconds = time.perf_counter() - self.open_stage[2]
+        cpu_seconds = time.process_time() - self.open_stage[3]
+        rows_in = self.open_stage[1] if rows_in is None else rows_in
+        self.open_stage = None
+        peak_traced_bytes = None
+        if self.trace_memory:
+            peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        if name == self.profile_stage:
+            if self.profile_tool == 'pyinstrument':
+                self.stage_profile.stop()
+            else:
+                self.stage_profile.disable()
+
+        stage = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                              'rows_in': None, 'rows_out': None, 'peak_traced_mb': None,
+                                              'peak_rss_mb': None})
+        stage['calls'] += 1
+        stage['wall_seconds'] += wall_seconds
+        stage['cpu_seconds'] += cpu_seconds
+        stage['rows_in'] = add_rows(stage['rows_in'], rows_in)
+        stage['rows_out'] = add_rows(stage['rows_out'], rows_in if rows_out is None else rows_out)
+        if peak_traced_bytes is not None:
+            stage['peak_traced_mb'] = max(stage['peak_traced_mb'] or 0, round(peak_traced_bytes / 2**20, 1))
+        peak_rss = peak_rss_bytes()
+        if peak_rss is not None:
+            stage['peak_rss_mb'] = max(stage['peak_rss_mb'] or 0, round(peak_rss / 2**20, 1))
+
+    # Rows out default to rows in, a stage that changes the row count sets rows_out on what the context returns. A stage
+    # that only knows how many rows it took once it has run, like a read, sets rows_in there too
+    def stage(self, name, rows_in=None):
+        if not self.enabled:
+            return disabled_stage
+        return self.measured_stage(name, rows_in)
+
+    @contextmanager
+    def measured_stage(self, name, rows_in):
+        rows = SimpleNamespace(rows_in=rows_in, rows_out=None)
+        self.begin(name, rows_in)
+        yield rows
+        self.end(name, rows.rows_out, rows.rows_in)
+
+    # Stages of one step of a run with several steps using the same stage names, like the overall analysis and the segment
+    # cuts of the report command, are recorded under the step's name (analysis.load, segments.load) rather than added up
+    def step(self, name):
+        return StepProfiler(self, name)
+
+    def report(self):
+        stages = [{**stage, 'wall_seconds': round(stage['wall_seconds'], 4), 'cpu_seconds': round(stage['cpu_seconds'], 4)}
+                  for stage in self.stages.values()]
+        return {'started': self.started.isoformat(timespec='seconds'),
+                'wall_seconds': round(sum(stage['wall_seconds'] for stage in self.stages.values()), 4),
+                'stages': stages}
+
+    # The report is written to report_path together with run_info (script, settings). The profiled stage's top functions
+    # are printed and its full profile saved next to the report, as a .prof file for cProfile or .html for pyinstrument
+    def write_report(self, run_info):
+        if not self.enabled:
+            return
+        with open(self.report_path, 'w') as file:
+            json.dump({**run_info, **self.report()}, file, indent=2, default=str)
+        if self.stage_profile is None:
+            return
+        profile_path = f'{os.path.splitext(self.report_path)[0]}_{self.profile_stage}'
+        if self.profile_tool == 'pyinstrument':
+            print(self.stage_profile.output_text())
+            with open(f'{profile_path}.html', 'w', encoding='utf-8') as file:
+                file.write(self.stage_profile.output_html())
+        else:
+            self.stage_profile.dump_stats(f'{profile_path}.prof')
+            pstats.Stats(self.stage_profile).sort_stats('cumulative').print_stats(25)
+
+class StepProfiler:
+    def __init__(self, profiler, step):
+        self.profiler = profiler
+        self.step = step
+
+    def begin(self, name, rows_in=None):
+        self.profiler.begin(f'{self.step}.{name}', rows_in)
+
+    def end(self, name, rows_out=None, rows_in=None):
+        self.profiler.end(f'{self.step}.{name}', rows_out, rows_in)
+
+    def stage(self, name, rows_in=None):
+        return self.profiler.stage(f'{self.step}.{name}', rows_in)
+
+# Default for functions that take an optional profiler
+disabled_profiler = StageProfiler()
@@ -0,0 +1,121 @@
+#This module holds the figure output used by the analysis scripts. Figures are either shown in interactive windows as before, or in batch mode rendered straight to image files with the Agg backend so the scripts can run in scheduled jobs
+
+import os
+import re
+import math
+import pickle
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+
+# Figures are saved by worker processes. The figure is pickled and closed in the calling process as soon as it is
+# handed off, and at most two figures per worker are in flight, so memory stays bounded however many figures a run makes
+def use_agg_backend():
+    matplotlib.use('Agg')
+
+def save_figure(figure_pickle, paths):
+    fig = pickle.loads(figure_pickle)
+    for path in paths:
+        fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+    return paths
+
+class FigureRenderer:
+    def __init__(self, mode='interactive', output_dir='.', formats=('png',), n_workers=1):
+        if mode not in ('interactive', 'batch'):
+            raise ValueError(f"render mode must be 'interactive' or 'batch', got {mode!r}")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.formats = formats
+        self.n_workers = n_workers
+        self.n_figures = 0
+        self.pending = set()
+        self.executor = None
+        if mode == 'batch':
+            plt.switch_backend('Agg')
+            os.makedirs(output_dir, exist_ok=True)
+            if n_workers > 1:
+                self.executor = ProcessPoolExecutor(max_workers=n_workers, initializer=use_agg_backend)
+
+    # Replaces plt.show(). In batch mode the current figure is saved as <number>_<title>.<format> in output_dir
+    def show(self):
+        if self.mode == 'interactive':
+            plt.show()
+            return
+
+        fig = plt.gcf()
+        self.n_figures += 1
+        title = next((ax.get_title() for ax in fig.axes if ax.get_title()), 'figure')
+        file_name = f"{self.n_figures:02d}_{re.sub(r'[^a-z0-9]+', '_', title.lower()).strip('_')}"
+        paths = [os.path.join(self.output_dir, f'{file_name}.{file_format}') for file_format in self.formats]
+        if self.executor is None:
+            for path in paths:
+                fig.savefig(path, bbox_inches='tight')
+            plt.close(fig)
+            return
+
+        if len(self.pending) >= 2 * self.n_workers:
+            done, self.pending = wait(self.pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        figure_pickle = pickle.dumps(fig)
+        plt.close(fig)
+        self.pending.add(self.executor.submit(save_figure, figure_pickle, paths))
+
+    # Waits for figures still being saved and raises the first error a worker hit
+    def close(self):
+        if self.executor is not None:
+            for future in self.pending:
+                future.result()
+            self.pending = set()
+            self.executor.shutdown()
+            self.executor = None
+
+# Heatmap drawn as a single pcolormesh, so render time does not grow with one artist per cell. Cells are only annotated
+# when the longest label fits inside them at fontsize, and tick labels are thinned to what fits along each axis, which
+# keeps large cohort matrices readable. rows_per_page splits the rows over several figures sharing one colour scale
+def plot_heatmap(data, title, xlabel, ylabel, renderer, cmap='Blues', fmt='.2f', fontsize=10, figsize=(16, 10), rows_per_page=None):
+    values = np.ma.masked_invalid(data.to_numpy(dtype='float64'))
+    vmin, vmax = (values.min(), values.max()) if values.count() else (0, 1)
+    rows_per_page = rows_per_page or max(len(data), 1)
+    n_pages = max(math.ceil(len(data) / rows_per_page), 1)
+    for page in range(n_pages):
+        rows = slice(page * rows_per_page, (page + 1) * rows_per_page)
+        page_values = values[rows]
+        n_rows, n_cols = page_values.shape
+
+        fig, ax = plt.subplots(figsize=figsize)
+        mesh = ax.pcolormesh(page_values, cmap=cmap, vmin=vmin, vmax=vmax, edgecolors='white', linewidth=0.5)
+        fig.colorbar(mesh, ax=ax).outline.set_linewidth(0)
+        ax.set_xlim(0, n_cols)
+        ax.set_ylim(n_rows, 0)
+        for spine in ax.spines.values():
+            spine.set_visible(False)
+
+        # Axes size in points after the colorbar took its share of the figure
+        position = ax.get_position()
+        width = fig.get_figwidth() * position.width * 72
+        height = fig.get_figheight() * position.height * 72
+        x_step = max(math.ceil(n_cols * fontsize * 3 / width), 1)
+        y_step = max(math.ceil(n_rows * fontsize * 1.5 / height), 1)
+        ax.set_xticks(np.arange(0, n_cols, x_step) + 0.5, [str(label) for label in data.columns[::x_step]])
+        ax.set_yticks(np.arange(0, n_rows, y_step) + 0.5, [str(label) for label in data.index[rows][::y_step]], rotation=0)
+
+        if n_rows and height / n_rows >= fontsize * 1.3:
+            cell_rows, cell_cols = np.nonzero(~np.ma.getmaskarray(page_values))
+            labels = [format(value, fmt) for value in page_values.data[cell_rows, cell_cols].astype(int if fmt.endswith('d') else float)]
+            if labels and max(map(len, labels)) * fontsize * 0.55 <= width / n_cols:
+                # Dark text on light cells and white text on dark cells, by relative luminance of the cell colour
+                rgb = mesh.cmap(mesh.norm(page_values.data[cell_rows, cell_cols]))[:, :3]
+                rgb = np.where(rgb <= .03928, rgb / 12.92, ((rgb + .055) / 1.055) ** 2.4)
+                dark = rgb.dot([.2126, .7152, .0722]) <= .408
+                for row, col, label, on_dark in zip(cell_rows, cell_cols, labels, dark):
+                    ax.text(col + 0.5, row + 0.5, label, ha='center', va='center', fontsize=fontsize,
+                            color='w' if on_dark else '.15')
+
+        page_title = title if n_pages == 1 else f'{title} ({page + 1}/{n_pages})'
+        ax.set_title(page_title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        renderer.show()
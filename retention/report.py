@@ -0,0 +1,120 @@
+#This module draws the retention report, the overall revenue/customer retention tables, curves and cohort heatmaps and the same curves and tables for every segment cut. It is the only part of the package that imports matplotlib, so compute-only runs never load it
+
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+from retention.render import plot_heatmap
+from retention.analysis import cohort_tables
+
+def plot_retention_table(retention_table, title, renderer, figsize=(10, 6)):
+    fig, ax = plt.subplots(figsize=figsize)
+    ax.axis('tight')
+    ax.axis('off')
+    table_data = retention_table.values
+    column_labels = retention_table.columns
+    table = ax.table(cellText=table_data, colLabels=column_labels, cellLoc='center', loc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(10)
+    table.scale(1.2, 1.2)
+    plt.title(title)
+    renderer.show()
+
+def plot_retention_curve(retention_rate, title, ylabel, label, period_name, renderer):
+    max_periods = len(retention_rate)
+    plt.figure(figsize=(12, 6))
+    plt.plot(range(1, max_periods + 1), retention_rate, marker='o', linestyle='-', color='b', label=label)
+    plt.title(title)
+    plt.xlabel(f'{period_name}s Since Signup')
+    plt.ylabel(ylabel)
+    plt.xticks(range(1, max_periods + 1, 1))
+    plt.ylim(0, 100)
+    plt.grid(True)
+    plt.legend(loc='best')
+    renderer.show()
+
+def plot_retention_curves(segments, retention_rates, title, ylabel, max_periods, period_name, renderer):
+    fig, ax = plt.subplots(figsize=(10, 6))
+    for segment, retention_rate in zip(segments, retention_rates):
+        ax.plot(range(1, max_periods + 1), retention_rate, marker='o', linestyle='-', label=str(segment))
+
+    ax.set_title(title)
+    ax.set_xlabel(f'{period_name}s Since Signup')
+    ax.set_ylabel(ylabel)
+    ax.set_xticks(range(1, max_periods + 1, 1))
+    ax.set_ylim(0, 100)
+    ax.grid(True)
+    ax.legend(loc='best')
+    renderer.show()
+
+# Overall revenue and customer retention tables and curves, then the cohort heatmaps
+def plot_retention_report(results, max_periods, period_name, renderer, cohorts_per_page=None):
+    revenue_curve, customer_curve = results.revenue_curve, results.customer_curve
+    xlabel, ylabel = f'{period_name}s Since Signup', f'Cohort {period_name}'
+    tables = cohort_tables(results, max_periods)
+
+    # Revenue Retention Curve and Table
+    lost_revenue_per_bucket = np.round(revenue_curve.lost).astype(int)
+    remaining_revenue_per_bucket = np.round(revenue_curve.remaining).astype(int)
+    retention_rate_per_bucket = np.round(revenue_curve.retention_rate).astype(int)
+    retention_table = pd.DataFrame({
+        period_name: range(1, max_periods + 1),
+        'Lost Revenue': lost_revenue_per_bucket,
+        'Remaining Revenue': remaining_revenue_per_bucket,
+        'Retention Rate (%)': [f"{rate}%" for rate in retention_rate_per_bucket]
+    })
+    plot_retention_table(retention_table, 'Revenue Retention Table', renderer)
+    plot_retention_curve(retention_rate_per_bucket, 'Revenue Retention Curve', 'Revenue Retention Rate (%)',
+                         'Revenue Retention Rate', period_name, renderer)
+
+    ## Revenue Retention Heat Map and Lost Revenue by Cohort
+    plot_heatmap(tables.revenue_retention, 'Revenue Retention Heatmap by Cohort', xlabel, ylabel,
+                 renderer, cmap="Blues", fmt=".2f", rows_per_page=cohorts_per_page)
+    plot_heatmap(tables.lost_revenue.round().astype(int), 'Lost Revenue Heatmap by Cohort', xlabel, ylabel,
+                 renderer, cmap="Reds", fmt="d", fontsize=8, rows_per_page=cohorts_per_page)
+
+    ## Customer Retention Analysis Curve and Table
+    retention_rates = [f"{round(rate)}%" for rate in customer_curve.retention_rate]
+    retention_table = pd.DataFrame({
+        period_name: range(1, max_periods + 1),
+        'Users Lost': customer_curve.lost,
+        'Users Retained': customer_curve.remaining,
+        'Retention Rate (%)': retention_rates
+    })
+    plot_retention_table(retention_table, 'Customer Retention Table', renderer)
+    plot_retention_curve([int(rate.strip('%')) for rate in retention_rates], 'Customer Retention Curve',
+                         'Retention Rate (%)', 'Retention Rate', period_name, renderer)
+
+    ## Customer Retention and Customer Loss Heat Map, only cohorts and periods with lost customers are shown
+    plot_heatmap(tables.customer_retention, 'Customer Retention Rate Heatmap by Cohort', xlabel, ylabel,
+                 renderer, cmap="Blues", fmt=".2f", rows_per_page=cohorts_per_page)
+    plot_heatmap(tables.lost_users.astype(float), f'Number of Users Lost per {period_name}', xlabel, ylabel,
+                 renderer, cmap="Reds", fmt=".0f", rows_per_page=cohorts_per_page)
+
+# Revenue and customer retention curves and aggregated tables of every segment cut
+def plot_segment_report(segmented_retention, segment_cuts, max_periods, period_name, renderer):
+    for column, cut_name in segment_cuts.items():
+        segments = segmented_retention[column].segments
+        revenue = segmented_retention[column].revenue
+        customers = segmented_retention[column].customers
+
+        # Revenue Retention Analysis
+        plot_retention_curves(segments, revenue.retention_rate, f'Revenue Retention Curve by {cut_name}',
+                              'Revenue Retention Rate (%)', max_periods, period_name, renderer)
+
+        # Customer Retention Analysis
+        plot_retention_curves(segments, customers.retention_rate, f'Customer Retention Curve by {cut_name}',
+                              'Customer Retention Rate (%)', max_periods, period_name, renderer)
+
+        # Create Aggregated Revenue Retention Table
+        revenue_retention_data = {period_name: range(1, max_periods + 1)}
+        for segment, retention_rate in zip(segments, np.round(revenue.retention_rate).astype(int)):
+            revenue_retention_data[f'{segment} Retention Rate (%)'] = [f"{rate}%" for rate in retention_rate]
+        plot_retention_table(pd.DataFrame(revenue_retention_data), f'Aggregated Revenue Retention Table by {cut_name}',
+                             renderer, figsize=(14, 8))
+
+        # Create Aggregated Customer Retention Table
+        customer_retention_data = {period_name: range(1, max_periods + 1)}
+        for segment, retention_rate in zip(segments, customers.retention_rate):
+            customer_retention_data[f'{segment} Retention Rate (%)'] = [f"{round(rate)}%" for rate in retention_rate]
+        plot_retention_table(pd.DataFrame(customer_retention_data), f'Aggregated Customer Retention Table by {cut_name}',
+                             renderer, figsize=(14, 8))
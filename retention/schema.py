@@ -0,0 +1,85 @@
+#This module declares the layout of the raw customer export, the columns the clean step reads, their types and the date formats they are written in, and types the text of each column against it. Rows with a value that does not parse are split off for the reject file rather than silently becoming missing values
+
+import pandas as pd
+
+# Column -> type. Only these columns are read, any other column in the export is skipped. Date values must match one of
+# date_formats exactly, 'date' columns drop the time of day but stay datetimes. Every column may be empty. Text columns
+# never reject a row, category ones are read as categories and string ones as plain text. OIDs are strings, exports may
+# key customers by numeric or alphanumeric IDs
+customer_schema = {
+    'oid': 'string',
+    'signup_date': 'datetime',
+    'conversion_date': 'datetime',
+    'cancellation_date': 'date',
+    'personal_person_geo_country': 'category',
+    'provider': 'category',
+    'current_mrr': 'float64',
+    'total_charges': 'float64',
+}
+date_formats = ['%Y-%m-%d', '%Y-%m-%d %H:%M:%S']
+
+# Export headers may still carry the spaces strip_whitespace removes, read_csv options are keyed by the raw header
+def raw_column_names(file_path):
+    header = pd.read_csv(file_path, encoding='utf-8', nrows=0).columns
+    return dict(zip(header.str.strip(), header))
+
+# usecols and dtype for read_csv. Everything that is parsed against the schema is read as text, so a bad value reaches
+# type_column instead of failing the whole read
+def schema_read_options(file_path):
+    raw_columns = raw_column_names(file_path)
+    missing_columns = [column for column in customer_schema if column not in raw_columns]
+    if missing_columns:
+        raise ValueError(f"{file_path} is missing the customer columns {', '.join(missing_columns)}")
+    return {'usecols': [raw_columns[column] for column in customer_schema],
+            'dtype': {raw_columns[column]: 'category' if dtype == 'category' else str
+                      for column, dtype in customer_schema.items()}}
+
+# A column whose values all parse in one go takes the fast path, a single typed conversion (a date format is given up on
+# at its first value that does not match) that cannot fail any value. Otherwise every value is parsed on its own with
+# failures left missing, dates one format at a time over the values no earlier format matched
+def parse_date_column(values):
+    for date_format in date_formats:
+        try:
+            return pd.to_datetime(values, format=date_format), False
+        except ValueError:
+            pass
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    unparsed = values.notna()
+    for date_format in date_formats:
+        parsed[unparsed] = pd.to_datetime(values[unparsed], format=date_format, errors='coerce')
+        unparsed &= parsed.isna()
+    return parsed, unparsed
+
+def parse_number_column(values, dtype):
+    try:
+        return values.astype(dtype), False
+    except ValueError:
+        pass
+    numbers = pd.to_numeric(values, errors='coerce')
+    return numbers.astype(dtype), values.notna() & numbers.isna()
+
+# Typed values of one column and which of them failed to parse
+def type_column(values, dtype):
+    if dtype in ('category', 'string'):
+        return values, False
+    if dtype in ('datetime', 'date'):
+        return parse_date_column(values)
+    return parse_number_column(values, dtype)
+
+# Types the stripped text of every schema column. Returns the typed rows and the rejected rows as read, with a
+# reject_reason naming the columns that did not parse
+def apply_schema(df):
+    typed = {}
+    failed = {}
+    for column in df.columns:
+        values, failed_values = type_column(df[column], customer_schema[column])
+        typed[column] = values.dt.normalize() if customer_schema[column] == 'date' else values
+        if failed_values is not False:
+            failed[column] = failed_values
+    typed = pd.DataFrame(typed)
+    if not failed:
+        return typed, df.iloc[:0].assign(reject_reason=pd.Series(dtype=object))
+    failed = pd.DataFrame(failed)
+    rejected = failed.any(axis=1)
+    rejected_rows = df[rejected].assign(reject_reason=failed[rejected].dot(failed.columns + ', ').str[:-2])
+    return typed[~rejected], rejected_rows
@@ -0,0 +1,239 @@
+#This module holds the segment cuts, revenue and customer retention curves for every segment of a column (region, provider, free trial) computed together, serially or over worker processes sharing the data, with loading and caching the cut results
+
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import retention.periods
+import retention.analysis
+import retention.compact
+from retention.analysis import RetentionCurve, load_retention_data, scan_retention_data
+from retention.compact import load_compact_retention_data
+from retention.cache import result_cache_key, load_cached_result, save_cached_result
+from retention.profile import disabled_profiler
+
+# Retention curves for every segment of every segment column at once. Losses are bincounted over
+# (segment code, period) pairs, weighted by MRR for revenue, and subtracted cumulatively from each segment's total
+SegmentRetention = namedtuple('SegmentRetention', ['segments', 'revenue', 'customers'])
+
+def calculate_segment_losses(segment_codes, n_segments, period_diff, max_periods, weights=None):
+    in_segment = segment_codes >= 0
+    in_range = in_segment & (period_diff >= 1) & (period_diff <= max_periods)
+    if weights is not None:
+        in_segment &= ~np.isnan(weights)
+        in_range &= ~np.isnan(weights)
+    total = np.bincount(segment_codes[in_segment], weights=None if weights is None else weights[in_segment],
+                        minlength=n_segments)
+    bins = segment_codes[in_range] * max_periods + period_diff[in_range].astype(int) - 1
+    lost = np.bincount(bins, weights=None if weights is None else weights[in_range],
+                       minlength=n_segments * max_periods).reshape(n_segments, max_periods)
+    return total, lost
+
+def segment_curve(total, lost):
+    remaining = total[:, None] - np.cumsum(lost, axis=1)
+    return RetentionCurve(lost, remaining, (remaining / total[:, None]) * 100)
+
+def calculate_segment_curve(segment_codes, n_segments, period_diff, max_periods, weights=None):
+    return segment_curve(*calculate_segment_losses(segment_codes, n_segments, period_diff, max_periods, weights))
+
+def calculate_segmented_retention(df, segment_columns, max_periods):
+    period_diff = df['period_diff'].to_numpy(dtype='float64', na_value=np.nan)
+    alltime_MRR = df['alltime_MRR'].to_numpy(dtype='float64', na_value=np.nan)
+    segmented_retention = {}
+    for column in segment_columns:
+        segment_codes, segments = pd.factorize(df[column])
+        segmented_retention[column] = SegmentRetention(
+            segments,
+            calculate_segment_curve(segment_codes, len(segments), period_diff, max_periods, weights=alltime_MRR),
+            calculate_segment_curve(segment_codes, len(segments), period_diff, max_periods))
+    return segmented_retention
+
+# Parallel segment computation. period_diff, alltime_MRR and, for every cut, its row numbers sorted by segment are
+# placed in shared memory once. Each worker attaches to it and computes the curves of a disjoint group of segments from
+# the contiguous slices (offset, length) of the sorted row numbers holding those segments, so it only touches their
+# rows. The sort is stable, every segment's rows keep their original order and every sum is added up exactly as in the
+# serial path. The partial curves are then merged by segment
+shared_arrays = {}
+
+def attach_shared_arrays(shared_blocks):
+    for name, (block_name, shape, dtype) in shared_blocks.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        shared_arrays[name] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+def calculate_segment_partition(cut_index, segment_group, row_slices, max_periods):
+    segment_rows = shared_arrays['segment_rows'][1][cut_index]
+    period_diff, alltime_MRR = shared_arrays['values'][1]
+    rows = np.concatenate([segment_rows[offset:offset + length] for offset, length in row_slices])
+    group_codes = np.repeat(np.arange(len(segment_group)), [length for _, length in row_slices])
+    revenue = calculate_segment_curve(group_codes, len(segment_group), period_diff[rows], max_periods,
+                                      weights=alltime_MRR[rows])
+    customers = calculate_segment_curve(group_codes, len(segment_group), period_diff[rows], max_periods)
+    return cut_index, segment_group, revenue, customers
+
+# A cut without any segments (no rows, or every row excluded) has no partial curves, its curves are the empty ones the
+# serial path gives
+def merge_segment_curves(n_segments, partial_curves, empty_curve):
+    if n_segments == 0:
+        return empty_curve
+    merged_fields = []
+    for field in range(len(RetentionCurve._fields)):
+        first_values = partial_curves[0][1][field]
+        merged_values = np.zeros((n_segments,) + first_values.shape[1:], dtype=first_values.dtype)
+        for segment_group, curve in partial_curves:
+            merged_values[segment_group] = curve[field]
+        merged_fields.append(merged_values)
+    return RetentionCurve(*merged_fields)
+
+def calculate_segmented_retention_parallel(df, segment_columns, max_periods, n_workers):
+    values = np.vstack([df['period_diff'].to_numpy(dtype='float64', na_value=np.nan),
+                        df['alltime_MRR'].to_numpy(dtype='float64', na_value=np.nan)])
+    factorized = [pd.factorize(df[column]) for column in segment_columns]
+    segment_rows = np.zeros((len(factorized), len(df)), dtype=np.intp)
+    for cut_index, (codes, _) in enumerate(factorized):
+        segment_rows[cut_index] = np.argsort(codes, kind='stable')
+    arrays = [('values', values), ('segment_rows', segment_rows)]
+
+    blocks = {}
+    try:
+        for name, array in arrays:
+            blocks[name] = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=blocks[name].buf)[...] = array
+        shared_blocks = {name: (blocks[name].name, array.shape, array.dtype) for name, array in arrays}
+
+        # Segments are dealt out largest first so every worker gets a similar number of rows. Rows without a segment
+        # (code -1) sort first and are skipped
+        tasks = []
+        for cut_index, (codes, segments) in enumerate(factorized):
+            sizes = np.bincount(codes[codes >= 0], minlength=len(segments))
+            offsets = np.count_nonzero(codes < 0) + np.cumsum(sizes) - sizes
+            by_size = np.argsort(-sizes, kind='stable')
+            for worker in range(min(n_workers, len(segments))):
+                segment_group = np.sort(by_size[worker::n_workers])
+                row_slices = [(offsets[segment], sizes[segment]) for segment in segment_group]
+                tasks.append((cut_index, segment_group, row_slices))
+
+        partial_revenue = [[] for _ in segment_columns]
+        partial_customers = [[] for _ in segment_columns]
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=attach_shared_arrays,
+                                 initargs=(shared_blocks,)) as executor:
+            futures = [executor.submit(calculate_segment_partition, cut_index, segment_group, row_slices, max_periods)
+                       for cut_index, segment_group, row_slices in tasks]
+            for future in futures:
+                cut_index, segment_group, revenue, customers = future.result()
+                partial_revenue[cut_index].append((segment_group, revenue))
+                partial_customers[cut_index].append((segment_group, customers))
+    finally:
+        for block in blocks.values():
+            block.close()
+            block.unlink()
+
+    no_rows = np.zeros(0, dtype=int)
+    empty_revenue = calculate_segment_curve(no_rows, 0, np.zeros(0), max_periods, weights=np.zeros(0))
+    empty_customers = calculate_segment_curve(no_rows, 0, np.zeros(0), max_periods)
+    segmented_retention = {}
+    for cut_index, (column, (_, segments)) in enumerate(zip(segment_columns, factorized)):
+        segmented_retention[column] = SegmentRetention(
+            segments,
+            merge_segment_curves(len(segments), partial_revenue[cut_index], empty_revenue),
+            merge_segment_curves(len(segments), partial_customers[cut_index], empty_customers))
+    return segmented_retention
+
+# Out-of-core segment computation over scan_retention_data. Each segment gets its code the first time it appears in a
+# batch, the order pd.factorize gives over the whole file, and every batch's segment totals and losses are added to
+# running totals that grow by a row per new segment. Counts are identical to the in-memory cuts, revenue can differ in
+# the last bits
+def pad_segments(values, n_segments):
+    return np.pad(values, [(0, n_segments - len(values))] + [(0, 0)] * (values.ndim - 1))
+
+def scan_segmented_retention(file_path, config, segment_columns, filters=None, batch_size=1_000_000):
+    max_periods = config.horizon
+    segment_codes = {column: {} for column in segment_columns}
+    revenue = {column: (np.zeros(0), np.zeros((0, max_periods))) for column in segment_columns}
+    customers = {column: (np.zeros(0, dtype=int), np.zeros((0, max_periods), dtype=int)) for column in segment_columns}
+    columns = segment_data_columns(segment_columns, filters)
+    for df in scan_retention_data(file_path, columns, config, filters, batch_size):
+        period_diff = df['period_diff'].to_numpy(dtype='float64', na_value=np.nan)
+        alltime_MRR = df['alltime_MRR'].to_numpy(dtype='float64', na_value=np.nan)
+        for column in segment_columns:
+            batch_codes, batch_segments = pd.factorize(df[column])
+            codes = segment_codes[column]
+            batch_to_codes = np.array([codes.setdefault(segment, len(codes)) for segment in batch_segments] + [-1])
+            batch_codes = batch_to_codes[batch_codes]
+            for sums, weights in [(revenue, alltime_MRR), (customers, None)]:
+                batch_sums = calculate_segment_losses(batch_codes, len(codes), period_diff, max_periods, weights)
+                sums[column] = tuple(pad_segments(running, len(codes)) + batch_sum
+                                     for running, batch_sum in zip(sums[column], batch_sums))
+    return {column: SegmentRetention(pd.Index(list(segment_codes[column])), segment_curve(*revenue[column]),
+                                     segment_curve(*customers[column]))
+            for column in segment_columns}
+
+# Segment cuts of the cleaned data without the excluded regions, which are left out at load. Results are cached like the
+# overall results, keyed on the cut columns, the excluded regions and analysis.py, which loads the data, as well, no
+# cache_dir computes them every time. compact and out_of_core load or scan the data as compute_retention_results does,
+# out_of_core leaves n_workers unused. Any column of the cleaned file can be a cut, only the cut columns and the columns
+# filtered on are read besides the dates and MRR
+segment_cut_names = {'country_region': 'Region', 'provider': 'Provider', 'free_trial': 'Free Trial'}
+
+def segment_data_columns(segment_columns, filters=None):
+    filter_columns = [column for column, _, _ in filters or []]
+    columns = ['signup_date', 'cancellation_date', 'alltime_MRR'] + list(segment_columns) + filter_columns
+    return list(dict.fromkeys(columns))
+
+def compute_segmented_retention(file_path, config, segment_columns, excluded_regions=('Other',), n_workers=1,
+                                cache_dir=None, cache_max_bytes=500_000_000, profiler=disabled_profiler, compact=False,
+                                out_of_core=False):
+    segment_columns = list(segment_columns)
+    if cache_dir:
+        with profiler.stage('cache_lookup'):
+            code_paths = [__file__, retention.analysis.__file__, retention.periods.__file__]
+            params = {**config._asdict(), 'segment_columns': segment_columns, 'excluded_regions': list(excluded_regions)}
+            if out_of_core:
+                params['out_of_core'] = True
+            elif compact:
+                code_paths.append(retention.compact.__file__)
+                params['compact'] = True
+            cache_key = result_cache_key(file_path, params, code_paths, cache_dir)
+            segmented_retention = load_cached_result(cache_dir, cache_key)
+        if segmented_retention is not None:
+            return segmented_retention
+
+    filters = [('country_region', 'not in', list(excluded_regions))] if excluded_regions else None
+    if out_of_core:
+        with profiler.stage('scan'):
+            segmented_retention = scan_segmented_retention(file_path, config, segment_columns, filters)
+    else:
+        columns = segment_data_columns(segment_columns, filters)
+        if compact:
+            df = load_compact_retention_data(file_path, columns, config, profiler, filters)
+        else:
+            df = load_retention_data(file_path, columns, config, profiler, filters)
+        with profiler.stage('segments', len(df)):
+            if n_workers > 1:
+                segmented_retention = calculate_segmented_retention_parallel(df, segment_columns, config.horizon,
+                                                                             n_workers)
+            else:
+                segmented_retention = calculate_segmented_retention(df, segment_columns, config.horizon)
+    if cache_dir:
+        with profiler.stage('cache_save'):
+            save_cached_result(cache_dir, cache_key, segmented_retention, cache_max_bytes)
+    return segmented_retention
+
+# One row per cut, segment and period since signup with the revenue and customer curves of that segment
+def segment_table(segmented_retention, period_name):
+    tables = []
+    for column, segment_retention in segmented_retention.items():
+        revenue, customers = segment_retention.revenue, segment_retention.customers
+        n_segments, max_periods = revenue.lost.shape
+        tables.append(pd.DataFrame({
+            'cut': column,
+            'segment': np.repeat(np.asarray(segment_retention.segments, dtype=object), max_periods),
+            period_name: np.tile(np.arange(1, max_periods + 1), n_segments),
+            'Lost Revenue': revenue.lost.ravel(),
+            'Remaining Revenue': revenue.remaining.ravel(),
+            'Revenue Retention Rate (%)': revenue.retention_rate.ravel(),
+            'Users Lost': customers.lost.ravel(),
+            'Users Retained': customers.remaining.ravel(),
+            'Customer Retention Rate (%)': customers.retention_rate.ravel(),
+        }))
+    return pd.concat(tables, ignore_index=True)
@@ -0,0 +1,107 @@
+#This module generates synthetic customer files with the same columns as the raw customer export, at any scale from thousands to tens of millions of rows, for benchmarking the pipeline without real customer data
+
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from retention.config import run_config
+
+# Countries with their share of customers and the messy spellings seen in raw exports, all of which the clean step
+# resolves back to the first name
+countries = {
+    'United States': (0.35, ['US', 'USA', 'United States of America', 'united states', ' United States ']),
+    'United Kingdom': (0.10, ['GB', 'GBR', 'United Kingdom of Great Britain and Northern Ireland', 'UNITED KINGDOM']),
+    'Germany': (0.08, ['DE', 'DEU', 'germany', 'Germany ']),
+    'Canada': (0.07, ['CA', 'CAN', ' canada']),
+    'France': (0.06, ['FR', 'FRA', 'france']),
+    'Australia': (0.05, ['AU', 'AUS', 'australia ']),
+    'Brazil': (0.05, ['BR', 'BRA', 'brazil']),
+    'India': (0.05, ['IN', 'IND', 'india']),
+    'Japan': (0.04, ['JP', 'JPN', 'japan']),
+    'South Korea': (0.03, ['KR', 'Korea, Republic of', 'Korea (Republic of)']),
+    'Mexico': (0.03, ['MX', 'MEX', 'mexico']),
+    'Netherlands': (0.03, ['NL', 'NLD', 'netherlands']),
+    'Turkey': (0.02, ['TR', 'Türkiye', 'turkey']),
+    'Vietnam': (0.02, ['VN', 'Viet Nam', 'vietnam']),
+    'South Africa': (0.02, ['ZA', 'ZAF', 'south africa']),
+}
+# Values that resolve to no known country and end up in the 'Other' region
+unknown_countries = ['Unknown', 'N/A', 'Narnia', 'EU', '--']
+
+providers = ['Stripe', 'PayPal', 'Apple', 'Google Play']
+provider_shares = [0.5, 0.25, 0.15, 0.1]
+plan_prices = [9.99, 19.99, 49.99, 99.0]
+plan_shares = [0.45, 0.3, 0.2, 0.05]
+
+# Each row is a customer signing up between start_date and end_date, the run's as-of date by default. Rates are shares
+# of rows: duplicate_oid_rate reuse an earlier OID, missing_date_rate have neither a conversion nor a cancellation date
+# (and are dropped by the clean step), messy_country_rate spell their country in one of the raw variants,
+# unknown_country_rate have an unresolvable country and missing_country_rate none at all
+def generate_customers(n_rows, seed=0, first_oid=0, start_date=datetime(2021, 1, 1), end_date=run_config.as_of_date,
+                       duplicate_oid_rate=0.02, missing_date_rate=0.01, messy_country_rate=0.15,
+                       unknown_country_rate=0.02, missing_country_rate=0.01, free_trial_rate=0.3,
+                       signup_time_rate=0.3, mean_lifetime_days=540):
+    rng = np.random.default_rng(seed)
+    oid = first_oid + np.arange(n_rows)
+    duplicate = rng.random(n_rows) < duplicate_oid_rate
+    oid[duplicate] = rng.integers(0, first_oid + n_rows, duplicate.sum())
+
+    # Signups are spread evenly over the period, some with a time of day. Conversion is the signup itself, or the end
+    # of a 7, 14 or 30 day free trial. Lifetimes are exponential and cancellations after end_date have not happened yet
+    start, end = np.datetime64(start_date, 's'), np.datetime64(end_date, 's')
+    signup_day = start.astype('datetime64[D]') + rng.integers(0, (end - start).astype('timedelta64[D]').astype(int), n_rows)
+    signup_time = np.where(rng.random(n_rows) < signup_time_rate, rng.integers(0, 86_400, n_rows), 0)
+    signup_date = signup_day.astype('datetime64[s]') + signup_time.astype('timedelta64[s]')
+    free_trial = rng.random(n_rows) < free_trial_rate
+    trial_days = np.where(free_trial, rng.choice([7, 14, 30], n_rows), 0)
+    conversion_date = signup_date + trial_days.astype('timedelta64[D]')
+    lifetime_days = rng.exponential(mean_lifetime_days, n_rows).astype(int)
+    cancellation_date = signup_day + lifetime_days.astype('timedelta64[D]')
+    cancelled = cancellation_date < end.astype('datetime64[D]')
+    cancellation_date = np.where(cancelled, cancellation_date, np.datetime64('NaT'))
+    missing_dates = rng.random(n_rows) < missing_date_rate
+    conversion_date[missing_dates] = np.datetime64('NaT')
+    cancellation_date[missing_dates] = np.datetime64('NaT')
+
+    # Active customers pay their plan price, most cancelled ones show no current MRR. Total charges cover the months
+    # between signup and cancellation (or end_date)
+    price = rng.choice(plan_prices, n_rows, p=plan_shares)
+    current_mrr = np.where(cancelled & (rng.random(n_rows) < 0.9), 0, price)
+    active_days = np.where(cancelled, lifetime_days, (end.astype('datetime64[D]') - signup_day).astype(int))
+    total_charges = np.round(price * np.maximum(np.floor(active_days / 30.44), 1), 2)
+
+    clean_names = list(countries)
+    country_codes = rng.choice(len(clean_names), n_rows, p=[share for share, _ in countries.values()])
+    variants = [[name] + spellings for name, (_, spellings) in countries.items()]
+    names = clean_names + [spelling for country in variants for spelling in country[1:]] + unknown_countries
+    variant_offsets = np.cumsum([len(clean_names)] + [len(country) - 1 for country in variants])
+    messy = rng.random(n_rows) < messy_country_rate
+    n_spellings = np.array([len(country) - 1 for country in variants])
+    spelling = (rng.random(n_rows) * n_spellings[country_codes]).astype(int)
+    country_codes = np.where(messy, variant_offsets[country_codes] + spelling, country_codes)
+    unknown = rng.random(n_rows) < unknown_country_rate
+    country_codes[unknown] = variant_offsets[-1] + rng.integers(0, len(unknown_countries), unknown.sum())
+    country_codes[rng.random(n_rows) < missing_country_rate] = -1
+
+    # Providers carry the stray whitespace the clean step strips
+    provider_names = providers + [f' {provider}' for provider in providers] + [f'{provider} ' for provider in providers]
+    provider_codes = rng.choice(len(providers), n_rows, p=provider_shares) + len(providers) * rng.choice(3, n_rows, p=[0.9, 0.05, 0.05])
+
+    return pd.DataFrame({
+        'oid': oid,
+        'signup_date': signup_date.astype('datetime64[ns]'),
+        'conversion_date': conversion_date.astype('datetime64[ns]'),
+        'cancellation_date': cancellation_date.astype('datetime64[ns]'),
+        'personal_person_geo_country': pd.Categorical.from_codes(country_codes, names),
+        'provider': pd.Categorical.from_codes(provider_codes, provider_names),
+        'current_mrr': current_mrr,
+        'total_charges': total_charges,
+    })
+
+# Files are written chunk_rows rows at a time so memory stays bounded at any n_rows. Every chunk has its own seed and
+# continues the OIDs of the one before, so duplicates can reach back across chunks
+def write_customer_file(path, n_rows, chunk_rows=1_000_000, seed=0, **rates):
+    for first_row in range(0, n_rows, chunk_rows):
+        chunk = generate_customers(min(chunk_rows, n_rows - first_row), seed=seed + first_row // chunk_rows,
+                                   first_oid=first_row, **rates)
+        chunk.to_csv(path, mode='w' if first_row == 0 else 'a', header=first_row == 0, index=False,
+                     date_format='%Y-%m-%d %H:%M:%S')
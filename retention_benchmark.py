@@ -0,0 +1,109 @@
+#This file benchmarks every stage of the pipeline on synthetic customer files of increasing size, recording time, throughput and peak memory per stage and flagging stages that got slower than the saved baseline. The stages are those the profiler records inside the real entry points, run_clean, compute_retention_results, compute_segmented_retention and the report, so the benchmark times exactly what the scripts and the retention command run
+
+import os
+import sys
+import json
+import argparse
+import pandas as pd
+from retention.config import run_config
+from retention.periods import period_names
+from retention.clean import run_clean
+from retention.analysis import compute_retention_results
+from retention.segments import compute_segmented_retention, segment_cut_names
+from retention.render import FigureRenderer
+from retention.report import plot_retention_report, plot_segment_report
+from retention.synthetic import write_customer_file
+from retention.profile import StageProfiler
+
+# Synthetic files of each size are generated once into the benchmark directory and reused by later runs. The directory
+# is --dir, else RETENTION_BENCHMARK_DIR, else retention_benchmark under the working directory, the sizes are --rows.
+# A stage is a regression when it takes regression_tolerance longer than in the baseline, stages under min_seconds are
+# too noisy to compare. Peak memory comes from a second, traced pass over each file, since tracing slows pandas and
+# matplotlib down too much for the timings of the same pass to mean anything
+benchmark_rows = [10_000, 100_000, 1_000_000]
+benchmark_dir = os.environ.get('RETENTION_BENCHMARK_DIR', 'retention_benchmark')
+regression_tolerance = 0.25
+min_seconds = 0.05
+
+# Runs the clean step, the overall analysis, the segment cuts and the report on one synthetic file, each under a
+# profiler of its own. Stages are named by step: clean.read, .strip, .parse, .drop_missing_dates, .dedup, .geo,
+# .features, .write_csv and .write_parquet, analysis.load, .periods, .curves and .cohorts, segments.load, .periods and
+# .segments, and report.render. Every stage has a row count, so every stage gets a throughput
+def run_benchmark(n_rows, work_dir, trace_memory=False):
+    raw_path = os.path.join(work_dir, f'customers_{n_rows}.csv')
+    if not os.path.exists(raw_path):
+        write_customer_file(raw_path, n_rows)
+    cleaned_path = os.path.join(work_dir, f'cleaned_customers_{n_rows}.csv')
+    parquet_path = os.path.join(work_dir, f'cleaned_customers_{n_rows}.parquet')
+    rejected_path = os.path.join(work_dir, f'rejected_customers_{n_rows}.csv')
+    profilers = {step: StageProfiler(True, trace_memory=trace_memory)
+                 for step in ['clean', 'analysis', 'segments', 'report']}
+
+    # Every country is resolved from an empty country cache, as on a first run
+    run_clean(raw_path, cleaned_path, parquet_path, run_config.as_of_date, profiler=profilers['clean'],
+              rejected_file_path=rejected_path)
+    results = compute_retention_results(parquet_path, run_config, profiler=profilers['analysis'])
+    segmented_retention = compute_segmented_retention(parquet_path, run_config, list(segment_cut_names),
+                                                      profiler=profilers['segments'])
+
+    # Every table and figure rendered headless
+    with profilers['report'].stage('render', n_rows):
+        renderer = FigureRenderer('batch', os.path.join(work_dir, f'figures_{n_rows}'), ['png'], 1)
+        period_name = period_names[run_config.granularity]
+        plot_retention_report(results, run_config.horizon, period_name, renderer)
+        plot_segment_report(segmented_retention, segment_cut_names, run_config.horizon, period_name, renderer)
+        renderer.close()
+
+    stages = [{**stage, 'stage': f"{step}.{stage['stage']}"}
+              for step, profiler in profilers.items() for stage in profiler.report()['stages']]
+    for stage in stages:
+        stage['rows_per_second'] = round(stage['rows_in'] / stage['wall_seconds']) \
+            if stage['rows_in'] and stage['wall_seconds'] else None
+    return stages
+
+# Stages that took regression_tolerance longer than the same stage at the same size in the baseline
+def find_regressions(runs, baseline):
+    baseline_seconds = {(run['rows'], stage['stage']): stage['wall_seconds'] for run in baseline for stage in run['stages']}
+    regressions = []
+    for run in runs:
+        for stage in run['stages']:
+            previous = baseline_seconds.get((run['rows'], stage['stage']))
+            seconds = stage['wall_seconds']
+            if previous is not None and seconds >= min_seconds and seconds > previous * (1 + regression_tolerance):
+                regressions.append((run['rows'], stage['stage'], previous, seconds))
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the retention pipeline on synthetic customer files')
+    parser.add_argument('--dir', default=benchmark_dir, help='directory for the synthetic files, results and baseline')
+    parser.add_argument('--rows', type=int, nargs='+', default=benchmark_rows, help='sizes of the synthetic files')
+    parser.add_argument('--no-memory', action='store_true', help='skip the traced pass measuring peak memory')
+    return parser
+
+if __name__ == '__main__':
+    args = build_parser().parse_args()
+    results_path = os.path.join(args.dir, 'benchmark_results.json')
+    baseline_path = os.path.join(args.dir, 'benchmark_baseline.json')
+    os.makedirs(args.dir, exist_ok=True)
+    runs = []
+    for n_rows in args.rows:
+        stages = run_benchmark(n_rows, args.dir)
+        if not args.no_memory:
+            traced = run_benchmark(n_rows, args.dir, trace_memory=True)
+            for stage, traced_stage in zip(stages, traced):
+                stage['peak_traced_mb'] = traced_stage['peak_traced_mb']
+        runs.append({'rows': n_rows, 'stages': stages})
+        print(pd.DataFrame(stages).drop(columns='calls').to_string(index=False))
+    with open(results_path, 'w') as file:
+        json.dump(runs, file, indent=2)
+
+    # The first run becomes the baseline, later runs are compared against it
+    if not os.path.exists(baseline_path):
+        with open(baseline_path, 'w') as file:
+            json.dump(runs, file, indent=2)
+        sys.exit(0)
+    with open(baseline_path) as file:
+        regressions = find_regressions(runs, json.load(file))
+    for n_rows, stage, previous, seconds in regressions:
+        print(f'Regression: {stage} at {n_rows} rows took {seconds:.3f}s, baseline {previous:.3f}s')
+    sys.exit(1 if regressions else 0)
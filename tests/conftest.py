@@ -0,0 +1,26 @@
+#This file holds the fixtures shared by the tests, a small synthetic raw customer export and the cleaned Parquet file the clean step writes from it
+
+import pytest
+from retention.config import run_config
+from retention.clean import run_clean
+from retention.synthetic import write_customer_file
+
+@pytest.fixture(scope='session')
+def raw_file(tmp_path_factory):
+    path = tmp_path_factory.mktemp('raw') / 'customers.csv'
+    write_customer_file(path, 5_000, seed=7)
+    return str(path)
+
+@pytest.fixture(scope='session')
+def cleaned_file(raw_file, tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp('cleaned')
+    run_clean(raw_file, str(output_dir / 'cleaned.csv'), str(output_dir / 'cleaned.parquet'), run_config.as_of_date)
+    return str(output_dir / 'cleaned.parquet')
+
+# The same cleaned data as a directory partitioned by country_region
+@pytest.fixture(scope='session')
+def partitioned_file(raw_file, tmp_path_factory):
+    output_dir = tmp_path_factory.mktemp('partitioned')
+    run_clean(raw_file, str(output_dir / 'cleaned.csv'), str(output_dir / 'cleaned'), run_config.as_of_date,
+              partition_columns=['country_region'])
+    return str(output_dir / 'cleaned')
@@ -0,0 +1,110 @@
+#This file checks the column-wise month differences of the clean step against relativedelta and the original row-by-row month_diff, alltime_monthdiff and alltime_MRR functions
+
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import pytest
+from dateutil.relativedelta import relativedelta
+from retention.config import run_config
+from retention.clean import calculate_month_diff, add_features
+
+def relativedelta_months(end, start):
+    if pd.isna(end) or pd.isna(start):
+        return pd.NA
+    delta = relativedelta(end.to_pydatetime(), start.to_pydatetime())
+    return delta.years * 12 + delta.months
+
+def random_dates(rng, n, with_time):
+    days = rng.integers(0, 4 * 366, n)
+    seconds = rng.integers(0, 24 * 60 * 60, n) if with_time else np.zeros(n, dtype='int64')
+    return pd.Series(pd.Timestamp('2020-01-01') + pd.to_timedelta(days, unit='D') + pd.to_timedelta(seconds, unit='s'))
+
+def assert_matches_relativedelta(end, start):
+    expected = pd.array([relativedelta_months(e, s) for e, s in zip(end, start)], dtype='Int64')
+    actual = calculate_month_diff(end, start)
+    assert actual.dtype == 'Int64'
+    pd.testing.assert_extension_array_equal(actual.array, expected)
+
+# Random pairs in either order, so about half end before they start
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('with_time', [False, True])
+def test_random_pairs(seed, with_time):
+    rng = np.random.default_rng(seed)
+    assert_matches_relativedelta(random_dates(rng, 5_000, with_time), random_dates(rng, 5_000, with_time))
+
+# Start days past the end of the end month are clipped to its last day, the time of day decides on the anchor day
+@pytest.mark.parametrize('end, start', [
+    ('2023-02-28', '2023-01-31'), ('2024-02-28', '2024-01-31'), ('2024-02-29', '2024-01-31'),
+    ('2023-04-30', '2023-03-31'), ('2023-02-28 00:00:00', '2023-01-31 12:00:00'),
+    ('2023-02-28 13:00:00', '2023-01-31 12:00:00'), ('2023-03-15 08:00:00', '2023-01-15 09:00:00'),
+    ('2023-03-15 10:00:00', '2023-01-15 09:00:00'), ('2023-01-31', '2023-02-28'), ('2023-01-31', '2023-03-31'),
+    ('2023-01-15 09:00:00', '2023-03-15 10:00:00'), ('2023-01-15 11:00:00', '2023-03-15 10:00:00'),
+    ('2023-01-30', '2023-01-30'), ('2022-12-31 23:59:59', '2023-01-01'),
+])
+def test_month_ends_and_times(end, start):
+    assert_matches_relativedelta(pd.Series(pd.to_datetime([end])), pd.Series(pd.to_datetime([start])))
+
+def test_missing_dates():
+    end = pd.Series(pd.to_datetime(['2023-03-01', None, None]))
+    start = pd.Series(pd.to_datetime([None, '2023-01-01', None]))
+    assert calculate_month_diff(end, start).isna().all()
+
+# The row-by-row functions the clean script applied before month differences were computed on whole columns, with
+# cancellation dates as dates and '' for customers who have not cancelled
+def baseline_month_diff(row):
+    if pd.isna(row['cancellation_date']):
+        return ''
+    return relativedelta(row['cancellation_date'], row['signup_date']).months + \
+           relativedelta(row['cancellation_date'], row['signup_date']).years * 12
+
+def baseline_alltime_monthdiff(row):
+    if row['month_diff'] != '':
+        return row['month_diff']
+    else:
+        end_date = datetime(2023, 1, 30)
+        return relativedelta(end_date, row['signup_date']).months + \
+               relativedelta(end_date, row['signup_date']).years * 12
+
+def baseline_alltime_MRR(row):
+    if row['current_mrr'] != 0:
+        return row['current_mrr']
+    else:
+        if row['alltime_monthdiff'] != 0:
+            return row['total_charges'] / row['alltime_monthdiff']
+        else:
+            return 0
+
+# Signups up to the as-of date, some cancelled in the same month, and zero MRR or charges for a share of customers so
+# every branch of alltime_MRR is taken
+@pytest.fixture
+def customers():
+    rng = np.random.default_rng(3)
+    n = 3_000
+    signup_date = random_dates(rng, n, True).clip(upper=run_config.as_of_date)
+    cancellation_date = (signup_date + pd.to_timedelta(rng.integers(0, 400, n), unit='D')).dt.normalize()
+    cancellation_date = cancellation_date.where((rng.random(n) < 0.6) & (cancellation_date <= run_config.as_of_date))
+    return pd.DataFrame({
+        'oid': [str(oid) for oid in range(n)],
+        'signup_date': signup_date,
+        'conversion_date': signup_date,
+        'cancellation_date': cancellation_date,
+        'personal_person_geo_country': 'US',
+        'current_mrr': np.where(rng.random(n) < 0.5, 0.0, rng.uniform(5, 50, n).round(2)),
+        'total_charges': np.where(rng.random(n) < 0.2, 0.0, rng.uniform(0, 500, n).round(2)),
+    })
+
+def test_features_match_row_by_row(customers):
+    df = add_features(customers.copy(), {'US': ['United States', 'North America']}, run_config.as_of_date)
+
+    baseline = customers.copy()
+    baseline['cancellation_date'] = baseline['cancellation_date'].dt.date
+    baseline['month_diff'] = baseline.apply(baseline_month_diff, axis=1)
+    baseline['alltime_monthdiff'] = baseline.apply(baseline_alltime_monthdiff, axis=1)
+    baseline['alltime_MRR'] = baseline.apply(baseline_alltime_MRR, axis=1)
+
+    assert (df['current_mrr'] == 0).any() and (df['alltime_monthdiff'] == 0).any()
+    assert df['month_diff'].isna().tolist() == (baseline['month_diff'] == '').tolist()
+    assert df['month_diff'].dropna().tolist() == baseline['month_diff'][baseline['month_diff'] != ''].tolist()
+    assert df['alltime_monthdiff'].tolist() == baseline['alltime_monthdiff'].tolist()
+    np.testing.assert_array_equal(df['alltime_MRR'].to_numpy(dtype='float64'),
+                                  baseline['alltime_MRR'].to_numpy(dtype='float64'))
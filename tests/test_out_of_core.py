@@ -0,0 +1,65 @@
+#This file checks that the out-of-core scans give the same results as loading the cleaned data into memory, at every granularity, in small and large batches and over the single file and the partitioned directory. Customer counts must match exactly. Revenue is summed in a different order batch by batch, so it only has to match to a relative 1e-9 of the largest value compared, far below a cent on any revenue figure
+
+import numpy as np
+import pytest
+from retention.config import run_config
+from retention.analysis import compute_retention_results, scan_retention_results
+from retention.segments import compute_segmented_retention, scan_segmented_retention, segment_cut_names
+
+revenue_rtol = 1e-9
+cuts = list(segment_cut_names) + ['personal_person_geo_country']
+
+def assert_same_counts(actual, expected):
+    assert actual.dtype.kind == expected.dtype.kind and actual.shape == expected.shape
+    np.testing.assert_array_equal(actual, expected)
+
+def assert_close_revenue(actual, expected):
+    assert actual.shape == expected.shape
+    scale = np.nanmax(np.abs(expected)) if np.isfinite(expected).any() else 0
+    np.testing.assert_allclose(actual, expected, rtol=revenue_rtol, atol=revenue_rtol * scale)
+
+def assert_same_curves(actual, expected, counts):
+    for actual_values, expected_values in zip(actual, expected):
+        if counts:
+            assert_same_counts(actual_values, expected_values)
+        else:
+            assert_close_revenue(actual_values, expected_values)
+
+@pytest.fixture(params=['cleaned_file', 'partitioned_file'])
+def file_path(request):
+    return request.getfixturevalue(request.param)
+
+@pytest.mark.parametrize('granularity', ['W', 'M', 'Q'])
+@pytest.mark.parametrize('batch_size', [13, 1_000_000])
+def test_scan_matches_in_memory(file_path, granularity, batch_size):
+    config = run_config._replace(granularity=granularity)
+    expected = compute_retention_results(file_path, config)
+    actual = scan_retention_results(file_path, config, batch_size=batch_size)
+
+    assert_same_curves(actual.customer_curve, expected.customer_curve, counts=True)
+    assert_same_curves(actual.revenue_curve, expected.revenue_curve, counts=False)
+    assert list(actual.cohort_state['cohorts']) == list(expected.cohort_state['cohorts'])
+    for aggregate in ['customer_changes', 'cohort_sizes', 'lost_users']:
+        assert_same_counts(actual.cohort_state[aggregate], expected.cohort_state[aggregate])
+    for aggregate in ['revenue_changes', 'lost_revenue']:
+        assert_close_revenue(actual.cohort_state[aggregate], expected.cohort_state[aggregate])
+    assert_same_curves(actual.cohort_survival[1:], expected.cohort_survival[1:], counts=True)
+    assert_close_revenue(actual.cohort_revenue.total_revenue, expected.cohort_revenue.total_revenue)
+    assert_close_revenue(actual.cohort_revenue.lost_revenue, expected.cohort_revenue.lost_revenue)
+
+# Batches meet segments in a different order than the whole file does, segments are compared by name
+@pytest.mark.parametrize('granularity', ['W', 'M', 'Q'])
+@pytest.mark.parametrize('batch_size', [13, 1_000_000])
+def test_segment_scan_matches_in_memory(file_path, granularity, batch_size):
+    config = run_config._replace(granularity=granularity)
+    expected = compute_segmented_retention(file_path, config, cuts)
+    actual = scan_segmented_retention(file_path, config, cuts, [('country_region', 'not in', ['Other'])], batch_size)
+
+    assert list(actual) == list(expected)
+    for column in cuts:
+        assert sorted(actual[column].segments) == sorted(expected[column].segments)
+        order = actual[column].segments.get_indexer(list(expected[column].segments))
+        assert_same_curves([values[order] for values in actual[column].customers], expected[column].customers,
+                           counts=True)
+        assert_same_curves([values[order] for values in actual[column].revenue], expected[column].revenue,
+                           counts=False)
@@ -0,0 +1,37 @@
+#This file checks that the segment cuts computed over worker processes are identical to the serial ones, bit for bit
+
+import numpy as np
+import pytest
+from retention.config import run_config
+from retention.analysis import load_retention_data
+from retention.segments import (calculate_segmented_retention, calculate_segmented_retention_parallel,
+                                segment_data_columns)
+
+cuts = ['country_region', 'provider', 'free_trial', 'personal_person_geo_country']
+
+def assert_same_segments(serial, parallel):
+    assert list(serial) == list(parallel)
+    for column in serial:
+        assert list(serial[column].segments) == list(parallel[column].segments)
+        for curve in ['revenue', 'customers']:
+            for expected, actual in zip(getattr(serial[column], curve), getattr(parallel[column], curve)):
+                assert actual.dtype == expected.dtype and actual.shape == expected.shape
+                np.testing.assert_array_equal(actual, expected)
+
+@pytest.fixture(scope='module')
+def segment_data(cleaned_file):
+    return load_retention_data(cleaned_file, segment_data_columns(cuts), run_config)
+
+@pytest.mark.parametrize('n_workers', [2, 3])
+def test_parallel_matches_serial(segment_data, n_workers):
+    serial = calculate_segmented_retention(segment_data, cuts, run_config.horizon)
+    parallel = calculate_segmented_retention_parallel(segment_data, cuts, run_config.horizon, n_workers)
+    assert_same_segments(serial, parallel)
+
+# Cuts without any segments, no rows at all or every row excluded
+@pytest.mark.parametrize('rows', ['none', 'excluded'])
+def test_parallel_matches_serial_without_segments(segment_data, rows):
+    df = segment_data.iloc[:0] if rows == 'none' else segment_data[segment_data['country_region'] == 'Nowhere']
+    serial = calculate_segmented_retention(df, cuts, run_config.horizon)
+    parallel = calculate_segmented_retention_parallel(df, cuts, run_config.horizon, 2)
+    assert_same_segments(serial, parallel)
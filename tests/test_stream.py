@@ -0,0 +1,63 @@
+#This file checks that streaming the clean step in chunks writes exactly what the in-memory clean step writes, the same cleaned CSV byte for byte, the same Parquet data and the same rejected rows, for a single export with unparseable rows and for a directory of exports where later files supersede earlier ones
+
+import numpy as np
+import pandas as pd
+import pytest
+from retention.config import run_config
+from retention.clean import run_clean
+from retention.synthetic import generate_customers
+
+chunk_size = 700
+
+# Unparseable dates and numbers in a few rows of every column typed by the schema, the clean step rejects those rows.
+# Some OIDs are alphanumeric, which are kept as text
+def write_export(path, n_rows, seed, first_oid=0):
+    df = generate_customers(n_rows, seed=seed, first_oid=first_oid).astype({'oid': str})
+    rng = np.random.default_rng(seed)
+    df['oid'] = df['oid'].where(rng.random(n_rows) > 0.02, 'C-' + df['oid'])
+    for column, bad_value in [('signup_date', '2022-13-45'), ('conversion_date', 'not a date'),
+                              ('cancellation_date', '31/12/2022'), ('current_mrr', 'abc'), ('total_charges', '1,000')]:
+        df[column] = df[column].astype(object)
+        df.loc[rng.choice(n_rows, 5, replace=False), column] = bad_value
+    df.to_csv(path, index=False, date_format='%Y-%m-%d %H:%M:%S')
+
+def clean_outputs(file_path, output_dir, partition_columns=(), **options):
+    output_dir.mkdir()
+    parquet_path = output_dir / ('cleaned' if partition_columns else 'cleaned.parquet')
+    run_clean(str(file_path), str(output_dir / 'cleaned.csv'), str(parquet_path), run_config.as_of_date,
+              rejected_file_path=str(output_dir / 'rejected.csv'), partition_columns=partition_columns, **options)
+    return output_dir / 'cleaned.csv', parquet_path, output_dir / 'rejected.csv'
+
+def assert_same_outputs(file_path, tmp_path, partition_columns=()):
+    csv, parquet, rejected = clean_outputs(file_path, tmp_path / 'in_memory', partition_columns)
+    stream_csv, stream_parquet, stream_rejected = clean_outputs(file_path, tmp_path / 'stream', partition_columns,
+                                                                stream=True, chunk_size=chunk_size)
+    assert stream_csv.read_bytes() == csv.read_bytes()
+    assert stream_rejected.read_bytes() == rejected.read_bytes()
+    assert len(pd.read_csv(rejected)) > 0
+
+    # Every streamed chunk writes its own dictionaries, so categories come back in the order the chunks first met them
+    # rather than sorted, the same categories and values are required. Partitions are written chunk by chunk, their
+    # rows are compared in OID order
+    expected, actual = pd.read_parquet(parquet), pd.read_parquet(stream_parquet)
+    if partition_columns:
+        expected = expected.sort_values('oid', ignore_index=True)
+        actual = actual.sort_values('oid', ignore_index=True)
+    for column in expected.select_dtypes('category'):
+        assert sorted(actual[column].cat.categories) == sorted(expected[column].cat.categories)
+    pd.testing.assert_frame_equal(actual, expected, check_categorical=False)
+
+@pytest.mark.parametrize('partition_columns', [(), ('country_region',)])
+def test_single_export(tmp_path, partition_columns):
+    write_export(tmp_path / 'customers.csv', 3_000, seed=11)
+    assert_same_outputs(tmp_path / 'customers.csv', tmp_path, partition_columns)
+
+# Three exports sharing OIDs, the last file holding an OID supersedes the rows of the files before it, one of them a
+# Parquet export
+def test_superseding_exports(tmp_path):
+    export_dir = tmp_path / 'exports'
+    export_dir.mkdir()
+    write_export(export_dir / '1_january.csv', 2_000, seed=21)
+    write_export(export_dir / '2_february.csv', 1_500, seed=22, first_oid=1_000)
+    generate_customers(1_000, seed=23, first_oid=1_800).to_parquet(export_dir / '3_march.parquet')
+    assert_same_outputs(export_dir, tmp_path)